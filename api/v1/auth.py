@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Request, HTTPException, Depends
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from jose import JWTError, jwt
+
+from public_key_gen import JWKSKeyRegistry
+from .graph_files.config import read_azure_config
+
+azure_settings = read_azure_config()
+CLIENT_ID = azure_settings['clientId']
+REQUIRED_SCOPES = "UpeaseUnified.ReadWrite.All"
+security = HTTPBearer()
+
+# To secure an endpoint, add the parameter current_user:dict = Depends(get_current_user) to the requesting function.
+
+def get_token_from_header(request: Request):
+    auth_header = request.headers.get("Authorization")
+    if not auth_header:
+        raise HTTPException(status_code=401, detail="Bearer token missing")
+
+    token = auth_header.split("Bearer ")[-1]
+    return token
+
+# Get the unverified header and the kid from the token
+
+def get_unverified_header(token):
+    unverified_header = jwt.get_unverified_header(token)
+    return unverified_header.get('kid')
+
+
+# Bounded LRU of verified token claims, keyed by the SHA-256 of the token.
+# Entries expire at the token's own exp, so a hit can skip the RS256 check safely.
+class VerifiedTokenCache:
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def token_key(token: str):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str):
+        key = self.token_key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return payload
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, token: str, payload: dict):
+        expires_at = payload.get("exp")
+        if not isinstance(expires_at, (int, float)) or expires_at <= time.time():
+            return
+        key = self.token_key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+token_cache = VerifiedTokenCache()
+
+
+def verify_token(token, public_key):
+    payload = jwt.decode(token, public_key, algorithms=["RS256"], audience=CLIENT_ID)
+    if payload.get("aud") != CLIENT_ID or payload.get("scp") != REQUIRED_SCOPES:
+        raise HTTPException(status_code=401, detail="Invalid audience or scope")
+    return payload
+
+
+# Verify the token
+async def get_current_user(authorization: HTTPAuthorizationCredentials = Depends(security)):
+    token = authorization.credentials
+    credentials_exception = HTTPException(
+        status_code=401,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    cached_payload = token_cache.get(token)
+    if cached_payload is not None:
+        return cached_payload
+    try:
+        key_registry = JWKSKeyRegistry.get_instance()
+        kid = get_unverified_header(token)
+
+        # Unknown kids trigger a shared, rate limited refresh in case the signing keys have rotated
+        public_key = await key_registry.get_key_or_refresh(kid)
+        if public_key is None:
+            raise credentials_exception
+        payload = verify_token(token, public_key)
+        token_cache.put(token, payload)
+        return payload
+    except JWTError as e:
+        raise HTTPException(status_code=401, detail=f"JWT Error: {str(e)}")
+
+
+async def refresh_jwks_periodically():
+    key_registry = JWKSKeyRegistry.get_instance()
+    while True:
+        await asyncio.sleep(key_registry.refresh_interval)
+        try:
+            await key_registry.refresh(force=True)
+        except Exception as e:
+            logging.warning(f"Scheduled JWKS refresh failed: {e}")
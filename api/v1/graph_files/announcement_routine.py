@@ -1,8 +1,6 @@
-import configparser
 from configparser import SectionProxy
-from .institute import Institute
-from .students import Students
-from .singletons import CosmosServiceClientSingleton, GraphServiceClientSingleton
+from .singletons import GraphServiceClientSingleton
+from .repository import CosmosRepository
 from msgraph.generated.models.item_body import ItemBody
 from msgraph.generated.models.message import Message
 from msgraph.generated.models.body_type import BodyType
@@ -12,23 +10,13 @@ from msgraph.generated.models.recipient import Recipient
 from msgraph.generated.users.item.messages.item.message_item_request_builder import MessageItemRequestBuilder
 from msgraph.generated.users.item.send_mail.send_mail_post_request_body import SendMailPostRequestBody
 
-
-config = configparser.ConfigParser()
-config.read(['config.cfg', 'config.dev.cfg'])
-azure_settings = config['azure']
-
-students_instance = Students(azure_settings)
-institute_instance = Institute(azure_settings)
-
 class AnnouncementRoutine:
     settings: SectionProxy
 
     def __init__(self, config: SectionProxy): 
         self.settings = config
         self.app_client = GraphServiceClientSingleton.get_instance()
-        self.cosmos_client = CosmosServiceClientSingleton.get_instance()
-        self.db = self.cosmos_client.get_database_client('courses_manipal')
-        self.container = self.db.get_container_client('courses_manipal')
+        self.repository = CosmosRepository('courses_manipal', 'courses_manipal')
 
 
     async def make_announcement_admin(self,user_id:str,subject:str,announcement_message:str,file_attachments:list,target_group_mails:list):
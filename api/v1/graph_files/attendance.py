@@ -0,0 +1,245 @@
+from bisect import bisect_left
+from datetime import datetime
+
+# Compact attendance representation stored on each course document:
+#
+# "attendance": {
+#     "version": 3,
+#     "dates": ["2023-10-02", "2023-10-03"],      sorted date vector shared by the whole course
+#     "index": {"<student_id>": 0, ...},          student id -> position in course["students"]
+#     "status": ["PA", "P-", ...],                one status column per student, aligned with "students"
+#     "counts": [[1, 1, 2], [1, 0, 1], ...],      present, absent and total records per student
+#     "sequence": 42                              bumped by every attendance or enrollment write
+# }
+#
+# status[i][j] is the status of students[i] on dates[j], NO_RECORD when nothing was recorded.
+# Columns may be shorter than "dates", the missing tail means no record.
+# counts[i] is maintained by every write, so percentages never need a scan of the column.
+# "sequence" orders the copies of the attendance in the student projection, an older write that
+# lands late is not applied over a newer one. Documents without it are at sequence 0.
+# This replaces the legacy per student "attendance_dates": [{date: status}, ...] lists.
+
+ATTENDANCE_VERSION = 3
+NO_RECORD = '-'
+PRESENT = 'P'
+ABSENT = 'A'
+LOW_ATTENDANCE_THRESHOLD = 75
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%Y/%m/%d")
+
+
+# Orders dates chronologically whatever format the add-in sent them in, unknown formats sort last
+def date_sort_key(date: str):
+    for date_format in DATE_FORMATS:
+        try:
+            return (0, datetime.strptime(date, date_format).date().isoformat(), date)
+        except ValueError:
+            continue
+    return (1, date, date)
+
+
+class AttendanceStore:
+    def __init__(self, course_data: dict):
+        self.students = course_data['students']
+        self.data = course_data['attendance']
+        self.dates = self.data['dates']
+        self.index = self.data['index']
+        self.status = self.data['status']
+        self.counts = self.data['counts']
+        # Change tracking, so a write can send only what moved as a patch
+        self.migrated = False
+        self.initial_rows = len(self.status)
+        self.dates_changed = False
+        self.changed_rows = set()
+        self.initial_sequence = self.data.get('sequence', 0)
+
+    # Wraps the attendance of a course document, migrating legacy documents in memory first
+    @classmethod
+    def from_course(cls, course_data: dict) -> 'AttendanceStore':
+        migrated = migrate_course_document(course_data)
+        store = cls(course_data)
+        store.migrated = migrated
+        return store
+
+    @property
+    def sequence(self) -> int:
+        return self.data.get('sequence', 0)
+
+    # Called once before writing the document back. Every write is guarded by the ETag of the read
+    # it was built from, so two writes that succeed never get the same sequence.
+    def advance_sequence(self) -> int:
+        self.data['sequence'] = self.initial_sequence + 1
+        return self.data['sequence']
+
+    # Whether anything made through the store needs writing back
+    @property
+    def changed(self) -> bool:
+        return self.migrated or len(self.status) != self.initial_rows or self.dates_changed or bool(self.changed_rows)
+
+    def position(self, student_id: str):
+        if len(self.status) < len(self.students):
+            self._index_new_students()
+        return self.index.get(student_id)
+
+    def add_student(self, student_data: dict) -> int:
+        position = self.position(student_data['student_id'])
+        if position is not None:
+            return position
+        self.students.append(student_data)
+        self._index_new_students()
+        return len(self.students) - 1
+
+    # Students appended to the document without going through the store get indexed lazily
+    def _index_new_students(self):
+        for position in range(len(self.status), len(self.students)):
+            self.index[self.students[position]['student_id']] = position
+            self.status.append('')
+            self.counts.append([0, 0, 0])
+
+    # Returns the position of date in the date vector, inserting it if it is new
+    def date_position(self, date: str) -> int:
+        key = date_sort_key(date)
+        position = bisect_left(self.dates, key, key=date_sort_key)
+        if position < len(self.dates) and self.dates[position] == date:
+            return position
+        self.dates.insert(position, date)
+        self.dates_changed = True
+        if position < len(self.dates) - 1:
+            # Shift the columns that already reach past the inserted date
+            for row, column in enumerate(self.status):
+                if len(column) > position:
+                    self.status[row] = column[:position] + NO_RECORD + column[position:]
+                    self.changed_rows.add(row)
+        return position
+
+    # Records a status unless the student already has one for that date. Returns True if recorded.
+    def record(self, student_id: str, date: str, status: str) -> bool:
+        validate_status(status)
+        row = self.position(student_id)
+        if row is None:
+            return False
+        column = self.date_position(str(date))
+        current = self.status[row]
+        if column < len(current) and current[column] != NO_RECORD:
+            return False
+        current = current.ljust(column + 1, NO_RECORD)
+        self.status[row] = current[:column] + status + current[column + 1:]
+        counts = self.counts[row]
+        counts[0] += status == PRESENT
+        counts[1] += status == ABSENT
+        counts[2] += 1
+        self.changed_rows.add(row)
+        return True
+
+    # (present, absent, total) for the student, (0, 0, 0) when not enrolled
+    def counters(self, student_id: str) -> tuple:
+        row = self.position(student_id)
+        if row is None:
+            return (0, 0, 0)
+        return tuple(self.counts[row])
+
+    # Recomputes the counters from the status columns, returns {student_id: (stored, actual)}
+    # for every student whose stored counters drifted from the records
+    def check_counters(self) -> dict:
+        drift = {}
+        for row, column in enumerate(self.status):
+            actual = count_statuses(column)
+            if list(self.counts[row]) != actual:
+                drift[self.students[row]['student_id']] = (list(self.counts[row]), actual)
+        return drift
+
+    def fix_counters(self):
+        self.counts[:] = [count_statuses(column) for column in self.status]
+
+    # Cosmos patch operations for the changes made through this store. None when the document
+    # has to be replaced as a whole (it was migrated from the legacy format or gained students).
+    #
+    # Every changed student costs two operations (status column and counters), so with the 10
+    # operations of a patch request only corrections touching up to 4-5 students go out as row
+    # patches. Recording a session for a whole class falls back to setting the status and counter
+    # matrices: that rewrites all of the attendance, and only saves the rest of the document
+    # (students, properties, assignments). A patch per session is not possible, since a session is
+    # one character in every student's status string rather than a path of its own.
+    # benchmarks/attendance_patch_ru.py measures both cases.
+    def patch_operations(self, max_operations: int):
+        if self.migrated or len(self.status) != self.initial_rows:
+            return None
+        operations = []
+        if self.sequence != self.initial_sequence:
+            operations.append({"op": "set", "path": "/attendance/sequence", "value": self.sequence})
+        if self.dates_changed:
+            operations.append({"op": "set", "path": "/attendance/dates", "value": self.dates})
+        row_operations = []
+        for row in sorted(self.changed_rows):
+            row_operations.append({"op": "set", "path": f"/attendance/status/{row}", "value": self.status[row]})
+            row_operations.append({"op": "set", "path": f"/attendance/counts/{row}", "value": self.counts[row]})
+        if len(operations) + len(row_operations) > max_operations:
+            # Too many columns moved for one patch request, send the status and counter matrices whole
+            row_operations = [
+                {"op": "set", "path": "/attendance/status", "value": self.status},
+                {"op": "set", "path": "/attendance/counts", "value": self.counts},
+            ]
+        return operations + row_operations
+
+    # {date: status} for every date the student has a record on, in date order
+    def student_record(self, student_id: str) -> dict:
+        row = self.position(student_id)
+        if row is None:
+            return {}
+        return {self.dates[column]: status for column, status in enumerate(self.status[row]) if status != NO_RECORD}
+
+
+def count_statuses(column: str) -> list:
+    present = column.count(PRESENT)
+    absent = column.count(ABSENT)
+    return [present, absent, len(column) - column.count(NO_RECORD)]
+
+
+def attendance_percentage(counts) -> float:
+    present, _, total = counts
+    return present * 100 / total if total else 0
+
+
+def validate_status(status):
+    if not isinstance(status, str) or len(status) != 1 or status == NO_RECORD:
+        raise ValueError(f"Attendance status must be a single character other than '{NO_RECORD}', got {status!r}")
+
+
+# Checks a whole submission up front, so one bad entry does not fail the writes it gets merged with
+def validate_attendance_submission(new_attendance_data: list):
+    for student in new_attendance_data:
+        for new_attendance in student['attendance_dates']:
+            for status in new_attendance.values():
+                validate_status(status)
+
+
+# Converts a course document from the legacy per student attendance_dates lists to the compact
+# representation. Returns True if the document changed and needs to be written back.
+def migrate_course_document(course_data: dict) -> bool:
+    students = course_data.setdefault('students', [])
+    legacy = any('attendance_dates' in student for student in students)
+    if 'attendance' in course_data and not legacy:
+        attendance = course_data['attendance']
+        if 'counts' in attendance:
+            return False
+        # Version 2 documents predate the counters, derive them from the status columns
+        attendance['counts'] = [count_statuses(column) for column in attendance['status']]
+        attendance['version'] = ATTENDANCE_VERSION
+        return True
+
+    course_data.setdefault('attendance', {
+        'version': ATTENDANCE_VERSION,
+        'dates': [],
+        'index': {},
+        'status': [],
+        'counts': [],
+    })
+    store = AttendanceStore(course_data)
+    for student in students:
+        store.position(student['student_id'])
+        for attendance in student.pop('attendance_dates', []):
+            for date, status in attendance.items():
+                # Legacy statuses were free text, keep their first letter ("Present" -> "P"). A legacy
+                # NO_RECORD status is the same as no entry, it must not fail the read being migrated.
+                if status and str(status)[:1] != NO_RECORD:
+                    store.record(student['student_id'], str(date), str(status)[:1].upper())
+    return True
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from azure.cosmos import PartitionKey
+from azure.cosmos.exceptions import CosmosResourceNotFoundError, CosmosResourceExistsError, CosmosAccessConditionFailedError
+from .attendance import AttendanceStore
+from .repository import CosmosRepository
+from .singletons import AsyncCosmosServiceClientSingleton
+
+PROJECTION_DATABASE = 'courses_manipal'
+PROJECTION_CONTAINER = 'attendance_by_student'
+
+# Materialized view of attendance partitioned by student, kept next to the course documents:
+#
+# {"id": student_id, "student_id": student_id,
+#  "courses": {"<course_id>": {"course_name": "...", "attendance_record": {"2023-10-02": "P", ...},
+#                              "counts": [present, absent, total], "sequence": 42}}}
+#
+# A student's attendance across every course is one single-partition point read. Course
+# documents stay the source of truth; the projection is updated after each attendance or
+# enrollment write and can be rebuilt from them with `python manage.py rebuild-attendance-projection`.
+# Each entry keeps the attendance sequence of the course document it was copied from and is only
+# replaced by a copy at least as new, so when two writes of a course update the projection out of
+# order the older one is dropped. The container is created on startup (see main.py).
+class AttendanceProjection:
+    def __init__(self, max_concurrency: int = 16):
+        self.repository = CosmosRepository(PROJECTION_DATABASE, PROJECTION_CONTAINER)
+        self.max_concurrency = max_concurrency
+
+    @staticmethod
+    async def ensure_container():
+        db = AsyncCosmosServiceClientSingleton.get_instance().get_database_client(PROJECTION_DATABASE)
+        await db.create_container_if_not_exists(id=PROJECTION_CONTAINER, partition_key=PartitionKey(path='/student_id'))
+
+    async def get_student(self, student_id: str):
+        try:
+            return await self.repository.read_item(student_id, partition_key=student_id)
+        except CosmosResourceNotFoundError:
+            return None
+
+    # The projections of many students in one query, by student id; students without one are left out
+    async def get_students(self, student_ids: list) -> dict:
+        try:
+            items = await self.repository.query_items(
+                query="SELECT * FROM c WHERE ARRAY_CONTAINS(@student_ids, c.student_id)",
+                parameters=[{'name': '@student_ids', 'value': list(student_ids)}])
+        except CosmosResourceNotFoundError:
+            return {}
+        return {item['student_id']: item for item in items}
+
+    # Copies the attendance of the given students (all enrolled students when None) from the course document
+    async def update_course(self, course_data: dict, store: AttendanceStore, student_ids=None):
+        if student_ids is None:
+            student_ids = [student['student_id'] for student in course_data['students']]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def update_student(student_id):
+            async with semaphore:
+                entry = {
+                    "course_name": course_data.get('name'),
+                    "attendance_record": store.student_record(student_id),
+                    "counts": list(store.counters(student_id)),
+                    "sequence": store.sequence,
+                }
+                await self._set_course_entry(student_id, course_data['id'], entry)
+
+        await asyncio.gather(*(update_student(student_id) for student_id in student_ids))
+
+    # Same as update_course, but a failure is only logged: the course document is already written
+    # and the projection can always be rebuilt from it
+    async def try_update_course(self, course_data: dict, store: AttendanceStore, student_ids=None):
+        try:
+            await self.update_course(course_data, store, student_ids)
+        except Exception as e:
+            logging.error(f"Attendance projection update failed for course {course_data['id']}: {e}")
+
+    async def _set_course_entry(self, student_id: str, course_id: str, entry: dict):
+        try:
+            await self._patch_course_entry(student_id, course_id, entry)
+        except CosmosResourceNotFoundError:
+            try:
+                await self.repository.create_item({"id": student_id, "student_id": student_id, "courses": {course_id: entry}})
+            except CosmosResourceExistsError:
+                # Another course created the document first, patch it now that it exists
+                await self._patch_course_entry(student_id, course_id, entry)
+
+    # The patch only applies while the stored entry is missing, predates sequences or is not newer
+    async def _patch_course_entry(self, student_id: str, course_id: str, entry: dict):
+        stored = f'c.courses["{course_id}"].sequence'
+        try:
+            await self.repository.patch_item(
+                student_id, [{"op": "set", "path": f"/courses/{course_id}", "value": entry}], partition_key=student_id,
+                filter_predicate=f"FROM c WHERE NOT IS_DEFINED({stored}) OR {stored} <= {int(entry['sequence'])}")
+        except CosmosAccessConditionFailedError:
+            # A newer write of the course already updated the entry
+            pass
+
+    async def rebuild(self, course_documents) -> int:
+        await self.ensure_container()
+        courses = 0
+        async for course_data in course_documents:
+            store = AttendanceStore.from_course(course_data)
+            await self.update_course(course_data, store)
+            courses += 1
+        return courses
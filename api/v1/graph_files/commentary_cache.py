@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import json
+import os
+from collections import OrderedDict, defaultdict
+
+from .config import read_azure_config
+
+
+# Key of a commentary: the attendance snapshot in canonical JSON (sorted keys, no whitespace),
+# the prompt version and the model, so an edited prompt or another model never gets old answers
+def commentary_key(attendance, prompt_version: int, model: str) -> str:
+    canonical = json.dumps(attendance, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{prompt_version}\n{model}\n{canonical}".encode()).hexdigest()
+
+
+# Content addressed cache of the LLM attendance commentaries. The completions run at temperature 0,
+# so the same snapshot always gets the same commentary and dashboards or repeated copilot asks are
+# answered without a call. Entries live in an in-memory LRU and, when commentary_cache_dir is set
+# in the config, in one JSON file per key there as well, which survives restarts and is shared by
+# the workers of a host.
+#
+# A changed snapshot hashes to a new key, so a stale commentary is never served. The entries of a
+# course are still dropped when its attendance is written (invalidate_course), since nothing will
+# ask for the old snapshot again and they would only take up room.
+class CommentaryCache:
+    _instance = None
+
+    def __init__(self, max_entries: int = 512, cache_dir: str = None, max_disk_entries: int = 10000):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._course_keys = defaultdict(set)
+        self._disk_writes = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = CommentaryCache(cache_dir=read_azure_config().get('commentary_cache_dir'))
+        return cls._instance
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if self.cache_dir:
+            try:
+                entry = await asyncio.to_thread(self._read_disk, key)
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                self.disk_hits += 1
+                self._remember(key, entry["commentary"], entry["course_ids"])
+                return entry["commentary"]
+        self.misses += 1
+        return None
+
+    # course_ids are the courses the snapshot was taken from, used to invalidate it
+    async def put(self, key: str, commentary: str, course_ids):
+        course_ids = sorted(set(course_ids))
+        self._remember(key, commentary, course_ids)
+        if self.cache_dir:
+            try:
+                await asyncio.to_thread(self._write_disk, key, {"commentary": commentary, "course_ids": course_ids})
+            except OSError:
+                pass
+
+    def _remember(self, key: str, commentary: str, course_ids: list):
+        self._entries[key] = (commentary, course_ids)
+        self._entries.move_to_end(key)
+        for course_id in course_ids:
+            self._course_keys[course_id].add(key)
+        while len(self._entries) > self.max_entries:
+            evicted_key, (_, evicted_course_ids) = self._entries.popitem(last=False)
+            self._forget(evicted_key, evicted_course_ids)
+
+    def _forget(self, key: str, course_ids: list):
+        for course_id in course_ids:
+            keys = self._course_keys.get(course_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._course_keys[course_id]
+
+    def _read_disk(self, key: str):
+        try:
+            with open(self._path(key)) as entry_file:
+                return json.load(entry_file)
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, entry: dict):
+        # Written aside and renamed, so a concurrent reader never sees half a file
+        temporary_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as entry_file:
+            json.dump(entry, entry_file)
+        os.replace(temporary_path, self._path(key))
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 0:
+            self._prune_disk()
+
+    # Removes the least recently written files over max_disk_entries
+    def _prune_disk(self):
+        with os.scandir(self.cache_dir) as entries:
+            files = [entry for entry in entries if entry.name.endswith(".json")]
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - self.max_disk_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    # Drops the commentaries of the snapshots that included the course. On disk only the entries
+    # this worker knows of are removed, the others are left to pruning.
+    def invalidate_course(self, course_id: str):
+        for key in self._course_keys.pop(course_id, set()):
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._forget(key, entry[1])
+            if self.cache_dir:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "size": len(self._entries),
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
@@ -1,7 +1,9 @@
 from configparser import ConfigParser
+from functools import lru_cache
 
+# Parsed once per process, every module shares the same section
+@lru_cache(maxsize=None)
 def read_azure_config():
     config = ConfigParser()
-    config.read('config.dev.cfg')
+    config.read(['config.cfg', 'config.dev.cfg'])
     return config['azure']
-
@@ -1,51 +1,160 @@
 import semantic_kernel as sk
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 from configparser import SectionProxy
-from semantic_kernel.planning.basic_planner import BasicPlanner
+from semantic_kernel.orchestration.context_variables import ContextVariables
+from semantic_kernel.planning.basic_planner import BasicPlanner, Plan, PROMPT
 import json
-import configparser
 from ..graph_files.students import Students
 from ..graph_files.courses import Courses
-from ..graph_files.institute import Institute
+from ..graph_files.openai import OpenAI
 from ..graph_files.skills import StudentSkills,CourseSkills
+from .kernel_pool import KernelPool
+from .plan_cache import PlanCache
+from . import copilot_stream
+import asyncio
+from types import SimpleNamespace
 import re
 import math
 
-config = configparser.ConfigParser()
-config.read(['config.cfg', 'config.dev.cfg'])
-azure_settings = config['azure']
+# A kernel with the chat service and the skill plugins registered, plus what BasicPlanner would
+# otherwise rebuild on every create_plan call: the planner prompt function and the list of
+# available functions. create_plan registers a new semantic function on the kernel each time it
+# runs, which a reused kernel would accumulate, so pooled kernels run the planner function directly.
+class CopilotKernel:
+    def __init__(self, kernel: sk.Kernel):
+        self.kernel = kernel
+        # Listed before the planner function is registered, so the planner does not offer itself
+        self.available_functions = BasicPlanner()._create_available_functions_string(kernel)
+        self.planner_function = kernel.create_semantic_function(
+            PROMPT, function_name="CreatePlan", plugin_name="BasicPlanner", max_tokens=1000, temperature=0.8)
+
+    async def create_plan(self, ask: str) -> Plan:
+        context = ContextVariables()
+        context["goal"] = ask
+        context["available_functions"] = self.available_functions
+        generated_plan = await self.planner_function.invoke(variables=context)
+        return Plan(prompt=PROMPT, goal=ask, plan=generated_plan)
 
-students_instance = Students(azure_settings)
-institute_instance = Institute(azure_settings)
-courses_instance = Courses(azure_settings)
 
 class UpeaseCopilot:
     settings: SectionProxy
     
 
-    def __init__(self, config:SectionProxy):
+    def __init__(self, config:SectionProxy, students: Students, courses: Courses, openai: OpenAI,
+                 pool_size: int = 4, chat_service = None):
         self.settings = config
+        self.students = students
+        self.courses = courses
+        self.openai = openai
+        self.chat_service = chat_service
+        # Plugins are stateless apart from the services they hold, every pooled kernel shares them
+        self.student_skills = StudentSkills(self.students, self.courses, self.openai)
+        self.course_skills = CourseSkills(self.courses, self.openai)
+        self.planner = BasicPlanner()
+        self.kernel_pool = KernelPool(self.build_kernel, size=pool_size)
+        self.plan_cache = PlanCache(classify=self.entity_kind)
 
-    async def upease_copilot(self,ask:str) -> str:
-        kernel = sk.Kernel()
-        api_key = self.settings["openai_api_key"]
-        api_base = self.settings["openai_api_base"]
-        aoai_chat_service = AzureChatCompletion(
-            deployment_name='UpEase-testing',
-            endpoint=api_base,
-            api_key=api_key
-        )
+    def build_kernel(self) -> CopilotKernel:
+        if self.chat_service is None:
+            api_key = self.settings["openai_api_key"]
+            api_base = self.settings["openai_api_base"]
+            self.chat_service = AzureChatCompletion(
+                deployment_name='UpEase-testing',
+                endpoint=api_base,
+                api_key=api_key
+            )
         # api_version = self.settings["openai_api_version"]
+        kernel = sk.Kernel()
         kernel.add_chat_service(
-            service = aoai_chat_service,service_id ="dv")
-        student_plugin = kernel.import_plugin(plugin_instance = StudentSkills(),plugin_name= "StudentSkills")
-        course_plugin = kernel.import_plugin(plugin_instance = CourseSkills(), plugin_name = "CourseSkills")
-        planner = BasicPlanner()
-        basic_plan = await planner.create_plan(ask,kernel)
-        # print(basic_plan)
-        results = await planner.execute_plan(basic_plan,kernel)
+            service = self.chat_service,service_id ="dv")
+        kernel.import_plugin(plugin_instance = self.student_skills,plugin_name= "StudentSkills")
+        kernel.import_plugin(plugin_instance = self.course_skills, plugin_name = "CourseSkills")
+        return CopilotKernel(kernel)
+
+    # Kind of a name in an ask for the plan cache: "student" or "course" when it confidently names
+    # records of exactly one of the rosters, otherwise None
+    async def entity_kind(self, name: str):
+        kinds = []
+        for kind, name_index in (("student", self.students.name_index), ("course", self.courses.name_index)):
+            await name_index.ensure_fresh()
+            if name_index.lookup(name)["score"] >= name_index.min_score:
+                kinds.append(kind)
+        return kinds[0] if len(kinds) == 1 else None
+
+    # Returns the plan for the ask and whether it came from the plan cache
+    async def _plan(self, ask: str, copilot_kernel: CopilotKernel):
+        cached_plan = await self.plan_cache.get(ask)
+        if cached_plan is not None:
+            # Same shape as the planner output execute_plan reads the JSON from
+            return Plan(prompt=PROMPT, goal=ask, plan=SimpleNamespace(result=cached_plan)), True
+        return await copilot_kernel.create_plan(ask), False
+
+    async def upease_copilot(self,ask:str) -> str:
+        async with self.kernel_pool.borrow() as copilot_kernel:
+            basic_plan, cached = await self._plan(ask, copilot_kernel)
+            # print(basic_plan)
+            results = await self.planner.execute_plan(basic_plan, copilot_kernel.kernel)
+        if not cached:
+            # Only plans that ran through are reused
+            await self.plan_cache.put(ask, basic_plan.generated_plan.result)
         return results
-        
 
-        
-        
+    # Streaming variant of upease_copilot, yields (event, data) pairs as the ask progresses:
+    #   planning  right away, before the planner round trip
+    #   plan      {"subtasks", "cached"} once the plan is known
+    #   step      {"index", "function", "args"} as a step starts
+    #   table     {"function", "markdown"} attendance tables, before their commentary is written
+    #   token     {"text"} commentary tokens as the completion streams them
+    #   result    {"index", "function", "output"} as a step finishes; the output of the last step
+    #             is what upease_copilot returns
+    #   error     {"message"} when the ask fails, nothing follows it
+    # The steps run as in BasicPlanner.execute_plan, every output becoming the input of the next.
+    async def upease_copilot_stream(self, ask: str):
+        events = asyncio.Queue()
+        finished = object()
+
+        async def run():
+            copilot_stream.start_stream(events)
+            try:
+                async with self.kernel_pool.borrow() as copilot_kernel:
+                    basic_plan, cached = await self._plan(ask, copilot_kernel)
+                    generated_plan = basic_plan.generated_plan.result
+                    plan_data = json.loads(generated_plan[generated_plan.index("{"):generated_plan.rindex("}") + 1])
+                    copilot_stream.emit("plan", {"subtasks": plan_data["subtasks"], "cached": cached})
+                    await self._execute_streamed(plan_data, copilot_kernel.kernel)
+                if not cached:
+                    await self.plan_cache.put(ask, generated_plan)
+            except Exception as error:
+                copilot_stream.emit("error", {"message": str(error)})
+            finally:
+                events.put_nowait((finished, None))
+
+        task = asyncio.create_task(run())
+        try:
+            yield "planning", {"ask": ask}
+            while True:
+                event, data = await events.get()
+                if event is finished:
+                    break
+                yield event, data
+        finally:
+            # The client went away mid ask
+            if not task.done():
+                task.cancel()
+
+    async def _execute_streamed(self, plan_data: dict, kernel: sk.Kernel):
+        context = ContextVariables()
+        context["input"] = plan_data["input"]
+        for index, subtask in enumerate(plan_data["subtasks"]):
+            plugin_name, function_name = subtask["function"].split(".")
+            kernel_function = kernel.plugins[plugin_name][function_name]
+            args = subtask.get("args", None)
+            copilot_stream.emit("step", {"index": index, "function": subtask["function"], "args": args or {}})
+            if args:
+                for key, value in args.items():
+                    context[key] = value
+            output = await kernel_function.invoke(variables=context)
+            if output.error_occurred:
+                raise RuntimeError(output.last_error_description)
+            copilot_stream.emit("result", {"index": index, "function": subtask["function"], "output": output.result})
+            context["input"] = output.result
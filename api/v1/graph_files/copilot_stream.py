@@ -0,0 +1,27 @@
+import contextvars
+import json
+
+# Events of the copilot ask being streamed in the current task, None when the ask is not streamed.
+# The skills and the commentary completion push their partial output here, deep inside the plan,
+# without it being threaded through Semantic Kernel.
+_events = contextvars.ContextVar("copilot_events", default=None)
+
+
+def start_stream(queue):
+    _events.set(queue)
+
+
+def streaming() -> bool:
+    return _events.get() is not None
+
+
+# A no-op outside a streamed ask
+def emit(event: str, data):
+    queue = _events.get()
+    if queue is not None:
+        queue.put_nowait((event, data))
+
+
+# One server-sent event; the data is JSON, so newlines in markdown never break the framing
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
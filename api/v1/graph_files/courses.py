@@ -1,18 +1,37 @@
 
 from configparser import SectionProxy
 import re
-from .singletons import GraphServiceClientSingleton, CosmosServiceClientSingleton
-from .students import Students
+from .singletons import GraphServiceClientSingleton
+from .repository import CosmosRepository, MAX_PATCH_OPERATIONS
+from .extension_catalog import ExtensionCatalog
+from .graph_batch import GraphBatchClient, batch_error_message
+from .attendance import AttendanceStore, migrate_course_document, validate_attendance_submission, \
+    attendance_percentage, count_statuses, LOW_ATTENDANCE_THRESHOLD
+from .write_coalescer import CourseWriteCoalescer
+from .attendance_projection import AttendanceProjection
+from .name_index import NameIndex
+from .commentary_cache import CommentaryCache
 from . import helpers
 
 from msgraph import  GraphServiceClient
-from msgraph.generated.applications.get_available_extension_properties import \
-    get_available_extension_properties_post_request_body
 from msgraph.generated.groups.groups_request_builder import GroupsRequestBuilder
 from msgraph.generated.models.group import Group
-from msgraph.generated.models.reference_create import ReferenceCreate
 from msgraph.generated.users.users_request_builder import UsersRequestBuilder
-from azure.cosmos import CosmosClient
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+
+def attendance_summary(course_id: str, course_name: str, course_attendance: dict, counts) -> dict:
+    present, absent, total = counts
+    return {
+        "course_id": course_id,
+        "course_name": course_name,
+        "attendance_record": course_attendance,
+        "present": present,
+        "absent": absent,
+        "total": total,
+        "attendance_percentage": round(attendance_percentage(counts)),
+        "below_threshold": total > 0 and attendance_percentage(counts) < LOW_ATTENDANCE_THRESHOLD,
+    }
 
 class Courses:
     settings: SectionProxy
@@ -22,43 +41,41 @@ class Courses:
     def __init__(self, config: SectionProxy):
         self.settings = config 
         self.app_client = GraphServiceClientSingleton.get_instance()
-        self.cosmos_client = CosmosServiceClientSingleton.get_instance()
-        self.db = self.cosmos_client.get_database_client('courses_manipal')
-        self.container = self.db.get_container_client('courses_manipal')
+        self.repository = CosmosRepository('courses_manipal', 'courses_manipal')
+        self.attendance_writer = CourseWriteCoalescer(self._commit_attendance)
+        self.attendance_projection = AttendanceProjection()
+        self.name_index = NameIndex(self.get_all_courses, id_key='id')
 
-    async def get_all_courses(self):
+    async def get_all_courses(self, page_size: int = 999):
+        courses = []
+        async for page in self.iter_course_pages(page_size=page_size):
+            courses.extend(page)
+        return courses
+
+    # Yields the courses one Graph page at a time, see Students.iter_student_pages
+    async def iter_course_pages(self, page_size: int = 100):
         query_params = GroupsRequestBuilder.GroupsRequestBuilderGetQueryParameters(
             select=['displayName', 'id', 'mail'],
-            orderby=['displayName']
+            orderby=['displayName'],
+            top=page_size
         )
         request_config = GroupsRequestBuilder.GroupsRequestBuilderGetRequestConfiguration(
             query_parameters=query_params
         )
 
-        groups = await self.app_client.groups.get(request_configuration=request_config)
-        courses = []
-        for group in groups.value:
-            course_data = {}
-            course_data['name'] = group.display_name
-            course_data['id'] = group.id
-            course_data['mail'] = group.mail
-            courses.append(course_data)
-        return courses
+        async for groups in helpers.iterate_graph_pages(self.app_client.groups, request_config):
+            courses = []
+            for group in groups.value:
+                course_data = {}
+                course_data['name'] = group.display_name
+                course_data['id'] = group.id
+                course_data['mail'] = group.mail
+                courses.append(course_data)
+            yield courses
         
     async def get_course_by_id(self,course_id):      #TODO Show students enrolled in the course.
         application_id = self.settings['course_dir_app']
-        application_id = application_id.strip()
-        extension_request_body = get_available_extension_properties_post_request_body.GetAvailableExtensionPropertiesPostRequestBody()
-        extension_request_body.is_synced_from_on_premises = False
-        result = await self.app_client.directory_objects.get_available_extension_properties.post(
-            extension_request_body)
-        extension_property_names_with_app = []
-        extension_property_names = []
-
-        for value in result.value:
-            if value.name[10:42] == re.sub("-", "", application_id):
-                extension_property_names_with_app.append(value.name)
-                extension_property_names.append(helpers.convert_key(value.name))
+        extension_property_names_with_app = await ExtensionCatalog.get_instance().get_extension_names(application_id)
         query_params = GroupsRequestBuilder.GroupsRequestBuilderGetQueryParameters(
             select=['displayName', 'id'] + [str(value) for value in extension_property_names_with_app],
             # Sort by display name
@@ -108,18 +125,20 @@ class Courses:
         course_properties['mail'] = result.mail
         course_properties['security_enabled'] = result.security_enabled
         print("Creation of the group in Azure AD was successful")
-        def create_course_document(self,course_name):
+        async def create_course_document(self,course_name):
             course_data = {'id': course_id,  # using course name (In graph) as unique id
                 'courses_manipal': course_id,
                 'name':course_name,
                 'students':[],
                 'properties': course_properties,
                 }
+            migrate_course_document(course_data)
 
 
-            self.container.create_item(course_data)
-        create_course_document(self,course_name=course_name)
+            await self.repository.create_item(course_data)
+        await create_course_document(self,course_name=course_name)
         print("Creation of the course in cosmos was successful")
+        self.name_index.upsert(course_id, course_name)
         return {
             "course_name": course_name,
             "course_id": course_id
@@ -149,30 +168,71 @@ class Courses:
 
     # When a student is added to a course, it adds the student (Represented by the id) to an M365 group instance
     # representing the course. It also adds the student to a cosmos DB item representing the course.
-
-    async def add_students_to_course(self,student_ids:list,course_id:str,students:Students):
-
-        def add_student_to_course_document(self,course_id, student_name,registration_number,student_id):
-            course_data_cosmos = self.container.read_item(partition_key = course_id, item = course_id)
-            student_data = {
+    # The profile lookups and member additions are packed into Graph $batch requests and the course
+    # document is written once for the whole request. Returns one result per student.
+    # A member addition depends on the profile lookup of its student, so a student whose profile
+    # cannot be read is never added to the group without also being added to the course document.
+    # The pair is adjacent and the batch size even, so the two always travel in the same batch.
+    async def add_students_to_course(self,student_ids:list,course_id:str):
+        batch_requests = []
+        for index, student_id in enumerate(student_ids):
+            batch_requests.append({
+                "id": f"profile-{index}",
+                "method": "GET",
+                "url": f"/users/{student_id}?$select=displayName,id,faxNumber",
+            })
+            batch_requests.append({
+                "id": f"member-{index}",
+                "method": "POST",
+                "url": f"/groups/{course_id}/members/$ref",
+                "body": {"@odata.id": f"https://graph.microsoft.com/v1.0/directoryObjects/{student_id}"},
+                "dependsOn": [f"profile-{index}"],
+            })
+        responses = await GraphBatchClient.get_instance().execute(batch_requests)
+
+        results = []
+        enrolled_students = []
+        for index, student_id in enumerate(student_ids):
+            profile = responses[f"profile-{index}"]
+            member = responses[f"member-{index}"]
+            if profile["status"] != 200:
+                # The member addition was not attempted (424)
+                results.append({"student_id": student_id, "status": "failed", "error": batch_error_message(profile)})
+                continue
+            if member["status"] == 204:
+                status = "enrolled"
+            elif member["status"] == 400 and "already exist" in batch_error_message(member):
+                status = "already_enrolled"
+            else:
+                results.append({"student_id": student_id, "status": "failed", "error": batch_error_message(member)})
+                continue
+            enrolled_students.append({
                 'student_id' : student_id,
-                'registration_number': registration_number,
-                'student_name': student_name,
-                'attendance_dates': [],
+                'registration_number': profile["body"].get("faxNumber"),
+                'student_name': profile["body"].get("displayName"),
                 'assignments': []
-            }
-            course_data_cosmos['students'].append(student_data)
-            self.container.upsert_item(course_data_cosmos)
-
-
-        for student_id in student_ids:
-            request_body = ReferenceCreate()
-            data = await students.get_student_by_id(id_num=student_id)
-            student_name = data['name']
-            registration_number = data['registration_number']
-            request_body.odata_id = f"https://graph.microsoft.com//v1.0//directoryObjects//{student_id}"
-            await self.app_client.groups.by_group_id(course_id).members.ref.post(request_body)
-            add_student_to_course_document(self,course_id=course_id,student_name=student_name,registration_number=registration_number,student_id = student_id)
+            })
+            results.append({"student_id": student_id, "status": status})
+
+        for attempt in range(5 if enrolled_students else 0):
+            course_data_cosmos = await self.repository.read_item(course_id, partition_key = course_id)
+            store = AttendanceStore.from_course(course_data_cosmos)
+            for student in enrolled_students:
+                store.add_student(student)
+            store.advance_sequence()
+            try:
+                await self.repository.replace_item(course_id, course_data_cosmos, etag=course_data_cosmos['_etag'],
+                                                   match_condition=MatchConditions.IfNotModified)
+            except CosmosAccessConditionFailedError:
+                # An attendance commit landed in between, enroll again on a fresh read
+                if attempt == 4:
+                    raise
+                continue
+            await self.attendance_projection.try_update_course(
+                course_data_cosmos, store, [student['student_id'] for student in enrolled_students])
+            CommentaryCache.get_instance().invalidate_course(course_id)
+            break
+        return results
 
     # When a student is added to a course in Console, the student is added
     # to an M365 group representing that course as well as a CosmosDB item representing the course.
@@ -202,6 +262,7 @@ class Courses:
     # The course item along with the student enrolment details will still be available in Cosmos for training purposes.
     async def retire_course_by_id(self,course_id:str):
         await self.app_client.groups.by_group_id(course_id).delete()
+        self.name_index.remove(course_id)
 
 
     # Gets students of a course. However, currently it will fetch all members of the M365 group representing the course.
@@ -223,41 +284,63 @@ class Courses:
             student_info.append(student_data)
         return student_info
     
-    # student_attendance_list_schema = [{
-    #  "Registration Number": int, attendance_list: [
-    # 02-10-2023: "P"]}]
+    # new_attendance_data schema = [{
+    #  "id": student_id, "attendance_dates": [{"02-10-2023": "P"}, ...]}]
+    # Dates a student already has a status for are left untouched.
+    # Concurrent submissions for the same course are merged by the coalescer and committed together.
     async def add_attendance_to_course_students(self,course_id:str,new_attendance_data):
-        data = self.container.read_item(item=course_id, partition_key=course_id)
-    # Iterate through each student in the item's student list
-        for student in new_attendance_data:
-            # Find the matching student in the course item
-            course_student = next((s for s in data['students'] if s['student_id'] == student['id']), None)
-            if course_student:
-                # Add new attendance dates without duplicating
-                existing_dates = set()
-                for attendance in course_student['attendance_dates']:
-                    for date in attendance:
-                        print(date)
-                        existing_dates.add(str(date))  # Add only the date key, which is a string
-
+        validate_attendance_submission(new_attendance_data)
+        await self.attendance_writer.submit(course_id, new_attendance_data)
+
+    # Applies every merged submission on a fresh read and writes it back guarded by the ETag
+    async def _commit_attendance(self, course_id: str, submissions: list):
+        data = await self.repository.read_item(course_id, partition_key=course_id)
+        store = AttendanceStore.from_course(data)
+        for new_attendance_data in submissions:
+            for student in new_attendance_data:
                 for new_attendance in student['attendance_dates']:
                     for date, status in new_attendance.items():
-                        print(date)
-                        if date not in existing_dates:
-                            course_student['attendance_dates'].append({date: status})
-                            existing_dates.add(str(date))
-        self.container.replace_item(course_id, data)
+                        store.record(student['id'], str(date), status)
+        if not store.changed:
+            return
+        store.advance_sequence()
+        patch_operations = store.patch_operations(max_operations=MAX_PATCH_OPERATIONS)
+        if patch_operations is None:
+            await self.repository.replace_item(course_id, data, etag=data['_etag'],
+                                               match_condition=MatchConditions.IfNotModified)
+            await self.attendance_projection.try_update_course(data, store)
+            CommentaryCache.get_instance().invalidate_course(course_id)
+        else:
+            await self.repository.patch_item(course_id, patch_operations, partition_key=course_id, etag=data['_etag'],
+                                             match_condition=MatchConditions.IfNotModified)
+            changed_student_ids = [data['students'][row]['student_id'] for row in sorted(store.changed_rows)]
+            await self.attendance_projection.try_update_course(data, store, changed_student_ids)
+            CommentaryCache.get_instance().invalidate_course(course_id)
     
     async def add_faculty_to_course(self,course_id,faculty_id):
         pass
+    # Sends the updated assignment lists as a patch of the affected students only, the full
+    # document is replaced when more students changed than one patch request can carry.
     async def add_assignment_to_course(self, course_id: str, assignments:list):
-        data = self.container.read_item(item=course_id, partition_key=course_id)
+        for attempt in range(5):
+            try:
+                return await self._write_assignments(course_id, assignments)
+            except CosmosAccessConditionFailedError:
+                # A concurrent attendance or assignment write changed the document, merge again on a fresh read
+                if attempt == 4:
+                    raise
+
+    async def _write_assignments(self, course_id: str, assignments:list):
+        data = await self.repository.read_item(course_id, partition_key=course_id)
+        store = AttendanceStore.from_course(data)
+        changed_rows = set()
         
         # Iterate through each assignment in the assignments list
         for assignment in assignments:
             # Find the matching student in the course item
-            course_student = next((s for s in data['students'] if s['student_id'] == assignment['student_id']), None)
-            if course_student:
+            row = store.position(assignment['student_id'])
+            if row is not None:
+                course_student = data['students'][row]
                 # Check if 'assignments' key exists for the student, if not, create it
                 if 'assignments' not in course_student:
                     course_student['assignments'] = []
@@ -276,60 +359,112 @@ class Courses:
                         'score': assignment['score'],
                         'max': assignment['max']
                     })
-
-        self.container.replace_item(course_id, data)
-
-
+                changed_rows.add(row)
+
+        if store.migrated or len(changed_rows) > MAX_PATCH_OPERATIONS:
+            await self.repository.replace_item(course_id, data, etag=data['_etag'],
+                                               match_condition=MatchConditions.IfNotModified)
+        elif changed_rows:
+            patch_operations = [
+                {"op": "set", "path": f"/students/{row}/assignments", "value": data['students'][row]['assignments']}
+                for row in sorted(changed_rows)
+            ]
+            # Each operation sets a whole assignments list built from this read, so it is guarded too
+            await self.repository.patch_item(course_id, patch_operations, partition_key=course_id, etag=data['_etag'],
+                                             match_condition=MatchConditions.IfNotModified)
+
+
+    # Served from the student partitioned attendance projection with one point read. The courses
+    # the projection has no entry for yet (not built, or its update has not landed) are read from
+    # the course documents. course_ids are the student's current courses: the projection keeps the
+    # courses a student was removed from, so it is never listed whole.
     async def get_student_attendance(self, student_id: str, course_ids: list):
+        projection = await self.attendance_projection.get_student(student_id)
+        projected_courses = projection['courses'] if projection is not None else {}
+        attendance_data = self._projection_attendance(projected_courses, course_ids)
+        unprojected = [course_id for course_id in course_ids if course_id not in projected_courses]
+        if unprojected:
+            attendance_data += (await self._get_students_attendance_from_courses({student_id: unprojected}))[student_id]
+        return attendance_data
+
+    # get_student_attendance for many students at once: student_course_ids maps each student id to
+    # the ids of their current courses. One query reads the projections of all of the students.
+    # The (student, course) pairs the projections have no entry for are read from the course
+    # documents, so a request that mixes projected and unprojected pairs takes a second query; once
+    # the projection is complete it is always the one query.
+    async def get_students_attendance(self, student_course_ids: dict) -> dict:
+        if not student_course_ids:
+            return {}
+        projections = await self.attendance_projection.get_students(list(student_course_ids))
+        attendance = {}
+        unprojected = {}
+        for student_id, course_ids in student_course_ids.items():
+            projected_courses = projections[student_id]['courses'] if student_id in projections else {}
+            attendance[student_id] = self._projection_attendance(projected_courses, course_ids)
+            missing = [course_id for course_id in course_ids if course_id not in projected_courses]
+            if missing:
+                unprojected[student_id] = missing
+        if unprojected:
+            for student_id, attendance_data in (await self._get_students_attendance_from_courses(unprojected)).items():
+                attendance[student_id] += attendance_data
+        return attendance
+
+    # Summaries of the requested courses found in the projection's courses, in the order requested
+    @staticmethod
+    def _projection_attendance(projected_courses: dict, course_ids: list) -> list:
         attendance_data = []
+        for course_id in course_ids:
+            course_entry = projected_courses.get(course_id)
+            if course_entry is None:
+                continue
+            attendance_data.append(attendance_summary(course_id, course_entry['course_name'], course_entry['attendance_record'],
+                                                      course_entry.get('counts') or count_statuses("".join(course_entry['attendance_record'].values()))))
+        return attendance_data
+
+    # Reads the course documents of every requested course in one query and picks the students'
+    # records out of them
+    async def _get_students_attendance_from_courses(self, student_course_ids: dict) -> dict:
+        attendance_data = {student_id: [] for student_id in student_course_ids}
+        course_ids = sorted({course_id for ids in student_course_ids.values() for course_id in ids})
+        if not course_ids:
+            return attendance_data
 
         # Original query without filtering for specific student
         query = """
-        SELECT c.id, c.students ,c.name
+        SELECT c.id, c.students, c.name, c.attendance
         FROM c 
         WHERE ARRAY_CONTAINS(@course_ids, c.id)
         """
 
         # Execute the query and fetch results
-        course_items = list(self.container.query_items(
+        course_items = await self.repository.query_items(
             query=query, 
             parameters=[
                 {'name': '@course_ids', 'value': course_ids}
-            ],
-            enable_cross_partition_query=True
-        ))
+            ]
+        )
         for course_item in course_items:
-            student_data = next((student for student in course_item['students'] if student['student_id'] == student_id), None)
-            
-            if student_data:
-                course_data = {"course_id": course_item['id'],"course_name":course_item['name']}
-
-                # Improved handling of attendance data
-                if 'attendance_dates' in student_data:
-                    course_attendance = {}
-                    for attendance_record in student_data['attendance_dates']:
-                        course_attendance.update(attendance_record)
-
-                    total_days = len(course_attendance)
-                    total_present = sum(status == "P" for status in course_attendance.values())
-
-                    attendance_percentage = (total_present / total_days) * 100 if total_days > 0 else 0
-
-                    course_data["attendance_record"] = course_attendance
-                    course_data["attendance_percentage"] = round(attendance_percentage)
-                else:
-                    course_data["attendance_record"] = {}
-                    course_data["attendance_percentage"] = 0
-
-                attendance_data.append(course_data)
+            store = AttendanceStore.from_course(course_item)
+            for student_id, requested_course_ids in student_course_ids.items():
+                if course_item['id'] not in requested_course_ids or store.position(student_id) is None:
+                    continue
+                attendance_data[student_id].append(attendance_summary(course_item['id'], course_item['name'], store.student_record(student_id),
+                                                                      store.counters(student_id)))
 
         return attendance_data
 
+    # Keeps the legacy attendance_dates shape in the response for the add-in and the console
     async def get_course_attendance(self,course_id):
-        course_data = self.container.read_item(item=course_id, partition_key=course_id)
+        course_data = await self.repository.read_item(course_id, partition_key=course_id)
+        store = AttendanceStore.from_course(course_data)
         attendance_data = []
         for student in course_data['students']:
-            student_attendance = {"student_name": student['student_name'], "student_id":student["student_id"],"attendance_dates":student["attendance_dates"]}
+            attendance_dates = [{date: status} for date, status in store.student_record(student['student_id']).items()]
+            counts = store.counters(student['student_id'])
+            student_attendance = {"student_name": student['student_name'], "student_id":student["student_id"],"attendance_dates":attendance_dates,
+                                  "present": counts[0], "absent": counts[1], "total": counts[2],
+                                  "attendance_percentage": attendance_percentage(counts),
+                                  "below_threshold": counts[2] > 0 and attendance_percentage(counts) < LOW_ATTENDANCE_THRESHOLD}
             attendance_data.append(student_attendance)
         return attendance_data
 
@@ -0,0 +1,59 @@
+import asyncio
+import re
+import time
+from .singletons import GraphServiceClientSingleton
+
+from msgraph import GraphServiceClient
+from msgraph.generated.applications.get_available_extension_properties import \
+    get_available_extension_properties_post_request_body
+
+# Caches the directory extension properties of the tenant, grouped by the owning app.
+# A single get_available_extension_properties call returns the extensions of every app, so one
+# fetch serves both stu_dir_app and course_dir_app until the TTL runs out or the schema changes.
+class ExtensionCatalog:
+    _instance = None
+    app_client: GraphServiceClient
+
+    def __init__(self, ttl: int = 600):
+        self.ttl = ttl
+        self.app_client = GraphServiceClientSingleton.get_instance()
+        self._properties_by_app = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = ExtensionCatalog()
+        return cls._instance
+
+    # Returns [{"name", "id", "data_type"}] for the extension properties owned by application_id
+    async def get_properties(self, application_id: str) -> list:
+        properties_by_app = self._properties_by_app
+        if properties_by_app is None or time.monotonic() - self._loaded_at > self.ttl:
+            properties_by_app = await self._load()
+        return properties_by_app.get(re.sub("-", "", application_id.strip()), [])
+
+    async def get_extension_names(self, application_id: str) -> list:
+        return [value["name"] for value in await self.get_properties(application_id)]
+
+    def invalidate(self):
+        self._properties_by_app = None
+
+    async def _load(self):
+        async with self._lock:
+            # Another request may have reloaded the catalog while this one waited on the lock
+            if self._properties_by_app is not None and time.monotonic() - self._loaded_at <= self.ttl:
+                return self._properties_by_app
+            extension_request_body = get_available_extension_properties_post_request_body.GetAvailableExtensionPropertiesPostRequestBody()
+            extension_request_body.is_synced_from_on_premises = False
+            result = await self.app_client.directory_objects.get_available_extension_properties.post(
+                extension_request_body)
+            properties_by_app = {}
+            for value in result.value:
+                # Extension names look like extension_<app id without dashes>_<property>
+                properties_by_app.setdefault(value.name[10:42], []).append(
+                    {"name": value.name, "id": value.id, "data_type": value.data_type})
+            self._properties_by_app = properties_by_app
+            self._loaded_at = time.monotonic()
+            return properties_by_app
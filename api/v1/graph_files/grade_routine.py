@@ -1,155 +1,95 @@
-import configparser
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from configparser import SectionProxy
-import numpy as np
-from .institute import Institute
-from .students import Students
+from datetime import datetime, timezone
+from azure.cosmos import PartitionKey
 from azure.identity.aio import ClientSecretCredential
 from msgraph import GraphServiceClient
-from azure.cosmos import CosmosClient, DatabaseProxy
-from .singletons import GraphServiceClientSingleton,CosmosServiceClientSingleton
+from .singletons import GraphServiceClientSingleton
+from .repository import CosmosRepository, COURSE_DOCUMENTS_QUERY
+from .singletons import AsyncCosmosServiceClientSingleton
+from .grading import grade_course
+from .tenant_manifest import TenantManifestCache
 
-
-config = configparser.ConfigParser()
-config.read(['config.cfg', 'config.dev.cfg'])
-azure_settings = config['azure']
-
-students_instance = Students(azure_settings)
-institute_instance = Institute(azure_settings)
+# Results of the institute wide grading job, one document per course and grade type:
+# {"id": "<grade_type>", "course_id": "...", "course_name": "...", "grade_type": "...",
+#  "computed_at": "<ISO timestamp>", "grades": [{"score", "grade", "student_id", "student_name"}]}
+GRADES_DATABASE = 'courses_manipal'
+GRADES_CONTAINER = 'course_grades'
 
 
 class GradeRoutine:
     settings: SectionProxy
     client_credential: ClientSecretCredential
     app_client: GraphServiceClient
-    client: CosmosClient
-    db: DatabaseProxy
+    repository: CosmosRepository
 
 
     def __init__(self, config: SectionProxy): 
         self.settings = config
-        self.cosmos_client = CosmosServiceClientSingleton.get_instance()
-        self.db = self.cosmos_client.get_database_client('courses_manipal')
-        self.container = self.db.get_container_client('courses_manipal')
+        self.repository = CosmosRepository('courses_manipal', 'courses_manipal')
         self.app_client = GraphServiceClientSingleton.get_instance()
 
     async def evaluate_grades_for_course(self, course_id, grade_type):
-        query = """
-            SELECT c.courses.grade_type_definitions
-            FROM c
-            WHERE c.id = @tenant_id
-        """
-    
-        # Setting the query parameters
-        parameters = [{"name": "@tenant_id", "value": self.settings['tenantId']}]
-        query_result = list(self.container.query_items(
-            query=query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
-
-        #? What if not query result
-        if query_result:
-            rules = query_result[0]['grade_type_definitions']
-
-        grading_system = GradingSystem(rules)
+        rules = await TenantManifestCache.get_instance(self.settings['tenantId']).get_section(
+            'courses', 'grade_type_definitions')
 
         # Get the scores for the course from the course document
-        course_data = self.container.read_item(partition_key = course_id, item = course_id)
-
-        scores = []
-        for student in course_data['students']:
-            if student['assignments'] == []:
-                return "No assignment data, Error"
-
-            total_score = 0
-            max_score = 0
-            
-            for assignment in student['assignments']:
-                total_score = total_score + assignment['score']
-                max_score = max_score + assignment['max']
-            
-            scores.append({
-                'student_id': student['student_id'], 
-                'student_name': student['student_name'],
-                'total_score': total_score*100/max_score,
-            })
-        
-        return grading_system.calculate_grades(grade_type, scores=scores)
-
-
-class GradingRule:
-    def __init__(self, rule_dict:dict):
-        self.grade = rule_dict['grade']
-        self.scale = rule_dict.get('scale', None)
-        self.abs_rule = rule_dict.get('abs_rule', None)
-        self.rel_rule = rule_dict.get('rel_rule', None)
-        self.type = rule_dict['type']
-
-    def evaluate_absolute(self, score) -> bool:
-        if self.abs_rule is not None:
-            return eval(self.abs_rule, {'total_score': score})
-        return False
-
-    def evaluate_relative(self, score, mean, std_dev) -> bool:
-        if self.rel_rule is not None:
-            return eval(self.rel_rule, {'total_score': score, 'mean': mean, 'std_dev': std_dev})
-        return False
-
-
-class GradingSystem:
-    def __init__(self, rules: list):
-        self.rules = [GradingRule(rule) for rule in rules]
-
-    def get_grade_scale(self, grade):
-        for rule in self.rules:
-            if grade == rule.grade:
-                return rule.scale
-        return None
-
-    def get_grade_by_scale(self, scale):
-        for rule in self.rules:
-            if scale == rule.scale:
-                return rule.grade
-        return None
-
-    def calculate_absolute_grade(self, score):
-        for rule in self.rules:
-            if rule.evaluate_absolute(score):
-                return rule.grade
-        return None
-
-    def calculate_relative_grade(self, score, mean, std_dev):
-        for rule in self.rules:
-            if rule.evaluate_relative(score, mean, std_dev):
-                return rule.grade
-        return None
-
-    def calculate_grades(self, grade_type: str, scores: list[dict]):
-        score_vals = [score['total_score'] for score in scores]
-        mean = np.mean(score_vals)
-        std_dev = np.std(score_vals)
-
-        student_grades = []
-
-        for score in scores:
-            if grade_type == 'absolute':
-                grade = self.calculate_absolute_grade(score['total_score'])
-
-            elif grade_type == 'relative':
-                absolute_grade = self.calculate_absolute_grade(score['total_score'])
-                relative_grade = self.calculate_relative_grade(score['total_score'], mean, std_dev)
-                absolute_scale = self.get_grade_scale(absolute_grade)
-                relative_scale = self.get_grade_scale(relative_grade)
-                grade = self.get_grade_by_scale(max(absolute_scale, relative_scale))
-
-            else:
-                grade = None
-
-            student_grades.append({
-                'score':score['total_score'], 
-                'grade':grade, 
-                'student_id':score['student_id'], 
-                'student_name':score['student_name']
-            })
-
-        return student_grades
\ No newline at end of file
+        course_data = await self.repository.read_item(course_id, partition_key = course_id)
+        return grade_course(rules, grade_type, course_data)
+
+    @staticmethod
+    async def ensure_grades_container():
+        db = AsyncCosmosServiceClientSingleton.get_instance().get_database_client(GRADES_DATABASE)
+        await db.create_container_if_not_exists(id=GRADES_CONTAINER, partition_key=PartitionKey(path='/course_id'))
+
+    # Grades every course of the institute and stores the results per course. Documents are streamed
+    # from Cosmos while the scoring runs on a pool of max_workers processes (one per core by default).
+    # A course that fails is recorded in the report and does not stop the others. on_progress, when
+    # given, is called after each course with (course_id, completed, total, error or None).
+    async def evaluate_grades_for_institute(self, grade_type, max_workers: int = None, on_progress=None) -> dict:
+        rules = await TenantManifestCache.get_instance(self.settings['tenantId']).get_section(
+            'courses', 'grade_type_definitions')
+        await self.ensure_grades_container()
+        grades_repository = CosmosRepository(GRADES_DATABASE, GRADES_CONTAINER)
+        total = (await self.repository.query_items(
+            COURSE_DOCUMENTS_QUERY.replace("SELECT *", "SELECT VALUE COUNT(1)")))[0]
+        report = {"courses": total, "graded": 0, "failed": {}}
+        max_workers = max_workers or os.cpu_count() or 1
+        loop = asyncio.get_running_loop()
+
+        async def grade_and_store(pool, course):
+            error = None
+            try:
+                grades = await loop.run_in_executor(pool, grade_course, rules, grade_type, course)
+                await grades_repository.upsert_item({
+                    "id": grade_type,
+                    "course_id": course['id'],
+                    "course_name": course.get('name'),
+                    "grade_type": grade_type,
+                    "computed_at": datetime.now(timezone.utc).isoformat(),
+                    "grades": grades,
+                })
+                report["graded"] += 1
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                report["failed"][course['id']] = error
+            finally:
+                in_flight.release()
+            if on_progress is not None:
+                on_progress(course['id'], report["graded"] + len(report["failed"]), total, error)
+
+        # Spawned workers import only the grading module (and __main__, see manage.py), not the clients of this process
+        with ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            # Keeps every worker busy without holding every course document in memory
+            in_flight = asyncio.Semaphore(max_workers * 2)
+            tasks = []
+            try:
+                async for course in self.repository.iter_items(COURSE_DOCUMENTS_QUERY):
+                    await in_flight.acquire()
+                    tasks.append(asyncio.ensure_future(grade_and_store(pool, course)))
+            finally:
+                await asyncio.gather(*tasks)
+        return report
@@ -0,0 +1,216 @@
+import ast
+import json
+import numpy as np
+
+# Pure grading code, kept free of the Graph and Cosmos clients so the batch grading job can
+# import it cheaply in every worker process.
+
+# Grading rules are small comparison expressions over total_score, mean and std_dev, e.g.
+# "mean + 0.5*std_dev > total_score >= mean - 0.5*std_dev". They are compiled once into NumPy
+# predicates that evaluate a whole cohort's score array in one pass. Only arithmetic, comparisons,
+# and/or/not, numbers and those three names are accepted, anything else is rejected at compile time.
+RULE_VARIABLES = ('total_score', 'mean', 'std_dev')
+_BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+}
+_COMPARE_OPERATORS = {
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+
+def compile_rule(rule: str):
+    try:
+        tree = ast.parse(rule, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid grading rule {rule!r}: {e.msg}")
+    return _compile_node(tree.body, rule)
+
+
+def _compile_node(node, rule: str):
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+        value = node.value
+        return lambda variables: value
+    if isinstance(node, ast.Name) and node.id in RULE_VARIABLES:
+        name = node.id
+        return lambda variables: variables[name]
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd, ast.Not)):
+        operand = _compile_node(node.operand, rule)
+        if isinstance(node.op, ast.USub):
+            return lambda variables: np.negative(operand(variables))
+        if isinstance(node.op, ast.Not):
+            return lambda variables: np.logical_not(operand(variables))
+        return operand
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        operator = _BINARY_OPERATORS[type(node.op)]
+        left = _compile_node(node.left, rule)
+        right = _compile_node(node.right, rule)
+        return lambda variables: operator(left(variables), right(variables))
+    if isinstance(node, ast.Compare) and all(type(op) in _COMPARE_OPERATORS for op in node.ops):
+        # a < b <= c is (a < b) and (b <= c), every operand evaluated once
+        operands = [_compile_node(operand, rule) for operand in [node.left] + node.comparators]
+        operators = [_COMPARE_OPERATORS[type(op)] for op in node.ops]
+
+        def compare(variables):
+            values = [operand(variables) for operand in operands]
+            result = operators[0](values[0], values[1])
+            for index in range(1, len(operators)):
+                result = np.logical_and(result, operators[index](values[index], values[index + 1]))
+            return result
+        return compare
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        values = [_compile_node(value, rule) for value in node.values]
+
+        def boolean(variables):
+            result = values[0](variables)
+            for value in values[1:]:
+                result = combine(result, value(variables))
+            return result
+        return boolean
+    raise ValueError(f"Unsupported expression {ast.dump(node)} in grading rule {rule!r}")
+
+
+class GradingRule:
+    def __init__(self, rule_dict:dict):
+        self.grade = rule_dict['grade']
+        self.scale = rule_dict.get('scale', None)
+        self.abs_rule = rule_dict.get('abs_rule', None)
+        self.rel_rule = rule_dict.get('rel_rule', None)
+        self.type = rule_dict['type']
+        self.abs_predicate = compile_rule(self.abs_rule) if self.abs_rule is not None else None
+        self.rel_predicate = compile_rule(self.rel_rule) if self.rel_rule is not None else None
+
+    def evaluate_absolute(self, score) -> bool:
+        if self.abs_predicate is not None:
+            return bool(self.abs_predicate({'total_score': score}))
+        return False
+
+    def evaluate_relative(self, score, mean, std_dev) -> bool:
+        if self.rel_predicate is not None:
+            return bool(self.rel_predicate({'total_score': score, 'mean': mean, 'std_dev': std_dev}))
+        return False
+
+
+class GradingSystem:
+    _compiled = {}
+
+    def __init__(self, rules: list):
+        self.rules = [GradingRule(rule) for rule in rules]
+        self.grades = np.array([rule.grade for rule in self.rules] + [None], dtype=object)
+        # Precomputed lookups, first rule wins like the linear scans they replace
+        self.grade_scales = {}
+        self.scale_grades = {}
+        for rule in self.rules:
+            self.grade_scales.setdefault(rule.grade, rule.scale)
+            self.scale_grades.setdefault(rule.scale, rule.grade)
+        self.rule_scales = np.array([np.nan if self.grade_scales[rule.grade] is None else self.grade_scales[rule.grade]
+                                     for rule in self.rules] + [np.nan], dtype=float)
+
+    # Compiles each distinct rule set once per process
+    @classmethod
+    def for_rules(cls, rules: list) -> 'GradingSystem':
+        key = json.dumps(rules, sort_keys=True)
+        if key not in cls._compiled:
+            cls._compiled[key] = GradingSystem(rules)
+        return cls._compiled[key]
+
+    def get_grade_scale(self, grade):
+        return self.grade_scales.get(grade)
+
+    def get_grade_by_scale(self, scale):
+        return self.scale_grades.get(scale)
+
+    def calculate_absolute_grade(self, score):
+        return self.grades[self._first_matching_rule('abs_predicate', {'total_score': np.array([score], dtype=float)})[0]]
+
+    def calculate_relative_grade(self, score, mean, std_dev):
+        variables = {'total_score': np.array([score], dtype=float), 'mean': mean, 'std_dev': std_dev}
+        return self.grades[self._first_matching_rule('rel_predicate', variables)[0]]
+
+    # Index of the first rule whose predicate holds, for every student at once.
+    # Students no rule matches get len(self.rules), which maps to a None grade.
+    def _first_matching_rule(self, predicate_name: str, variables: dict):
+        total_score = variables['total_score']
+        matches = np.zeros((len(self.rules) + 1, total_score.shape[0]), dtype=bool)
+        matches[-1] = True
+        for index, rule in enumerate(self.rules):
+            predicate = getattr(rule, predicate_name)
+            if predicate is not None:
+                matches[index] = np.broadcast_to(predicate(variables), total_score.shape)
+        return matches.argmax(axis=0)
+
+    def calculate_grades(self, grade_type: str, scores: list[dict]):
+        score_vals = np.array([score['total_score'] for score in scores], dtype=float)
+        if score_vals.size == 0:
+            return []
+        mean = np.mean(score_vals)
+        std_dev = np.std(score_vals)
+
+        if grade_type == 'absolute':
+            grades = self.grades[self._first_matching_rule('abs_predicate', {'total_score': score_vals})]
+
+        elif grade_type == 'relative':
+            absolute_rule = self._first_matching_rule('abs_predicate', {'total_score': score_vals})
+            relative_rule = self._first_matching_rule(
+                'rel_predicate', {'total_score': score_vals, 'mean': mean, 'std_dev': std_dev})
+            # The better of the two grades, a grade no rule matched does not count
+            best_scale = np.fmax(self.rule_scales[absolute_rule], self.rule_scales[relative_rule])
+            grades = [None if np.isnan(scale) else self.scale_grades.get(int(scale) if scale.is_integer() else scale)
+                      for scale in best_scale.tolist()]
+
+        else:
+            grades = [None] * len(scores)
+
+        student_grades = []
+        for score, grade in zip(scores, grades):
+            student_grades.append({
+                'score':score['total_score'], 
+                'grade':grade, 
+                'student_id':score['student_id'], 
+                'student_name':score['student_name']
+            })
+
+        return student_grades
+
+
+# Percentage score of every student with assignments. Students without any assignment (or with
+# nothing to score against) are returned separately instead of failing the whole course.
+def course_scores(course_data: dict):
+    scores = []
+    ungraded = []
+    for student in course_data['students']:
+        assignments = student.get('assignments') or []
+        total_score = sum(assignment['score'] for assignment in assignments)
+        max_score = sum(assignment['max'] for assignment in assignments)
+        if not max_score:
+            ungraded.append(student)
+            continue
+        scores.append({
+            'student_id': student['student_id'],
+            'student_name': student['student_name'],
+            'total_score': total_score*100/max_score,
+        })
+    return scores, ungraded
+
+
+# Grades one course document. Ungraded students are listed last with no score and no grade and
+# do not count towards the mean and standard deviation of the relative grading.
+def grade_course(rules: list, grade_type: str, course_data: dict) -> list:
+    scores, ungraded = course_scores(course_data)
+    student_grades = GradingSystem.for_rules(rules).calculate_grades(grade_type, scores=scores)
+    for student in ungraded:
+        student_grades.append({
+            'score': None,
+            'grade': None,
+            'student_id': student['student_id'],
+            'student_name': student['student_name'],
+        })
+    return student_grades
@@ -0,0 +1,121 @@
+import asyncio
+import time
+import httpx
+from .singletons import ClientSecretCredentialSingleton
+
+GRAPH_SCOPE = 'https://graph.microsoft.com/.default'
+
+# Sends Graph requests through the JSON $batch endpoint, 20 requests per batch with a few
+# batches in flight at once. Callers describe each request as a dict with "id", "method", "url"
+# (relative to /v1.0) and optionally "body", and get back a dict of responses keyed by id.
+# "dependsOn" lists ids the request waits for, Graph answers it with 424 when one of them
+# failed. They have to end up in the same 20, so keep dependent requests next to each other.
+class GraphBatchClient:
+    _instance = None
+    BATCH_URL = 'https://graph.microsoft.com/v1.0/$batch'
+    MAX_BATCH_SIZE = 20
+
+    def __init__(self, max_concurrent_batches: int = 4, max_retries: int = 3):
+        self.credential = ClientSecretCredentialSingleton.get_instance()
+        self.max_concurrent_batches = max_concurrent_batches
+        self.max_retries = max_retries
+        self.http_client = httpx.AsyncClient(timeout=60)
+        self._access_token = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = GraphBatchClient()
+        return cls._instance
+
+    @classmethod
+    async def close(cls):
+        if cls._instance is not None:
+            await cls._instance.http_client.aclose()
+            cls._instance = None
+
+    async def execute(self, requests: list) -> dict:
+        semaphore = asyncio.Semaphore(self.max_concurrent_batches)
+        responses = {}
+
+        async def run_batch(batch):
+            async with semaphore:
+                responses.update(await self._post_batch(batch))
+
+        batches = [requests[i:i + self.MAX_BATCH_SIZE] for i in range(0, len(requests), self.MAX_BATCH_SIZE)]
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+        return responses
+
+    async def _post_batch(self, batch: list) -> dict:
+        responses = {}
+        pending = [self._batch_request(request) for request in batch]
+        for attempt in range(self.max_retries + 1):
+            result = await self.http_client.post(
+                self.BATCH_URL,
+                json={"requests": pending},
+                headers={"Authorization": f"Bearer {await self._get_token()}"},
+            )
+            if result.status_code in (429, 503) and attempt < self.max_retries:
+                # The whole batch was throttled, send it again as it is
+                await asyncio.sleep(retry_after_seconds(result.headers, attempt))
+                continue
+            result.raise_for_status()
+            throttled = set()
+            retry_after = 0
+            for response in result.json()["responses"]:
+                if response["status"] in (429, 503) and attempt < self.max_retries:
+                    throttled.add(response["id"])
+                    retry_after = max(retry_after, retry_after_seconds(response.get("headers", {}), attempt))
+                else:
+                    responses[response["id"]] = response
+            if not throttled:
+                break
+            # Only the throttled requests are sent again, after the longest Retry-After Graph asked for,
+            # along with the ones that failed (424) because a throttled request they depend on did
+            retried = throttled | {request["id"] for request in pending
+                                   if responses.get(request["id"], {}).get("status") == 424
+                                   and throttled.intersection(request.get("dependsOn", ()))}
+            pending = [self._depending_on(request, retried) for request in pending if request["id"] in retried]
+            await asyncio.sleep(retry_after)
+        return responses
+
+    @staticmethod
+    def _batch_request(request: dict) -> dict:
+        batch_request = {"id": request["id"], "method": request["method"], "url": request["url"]}
+        if "body" in request:
+            batch_request["body"] = request["body"]
+            batch_request["headers"] = {"Content-Type": "application/json"}
+        if request.get("dependsOn"):
+            batch_request["dependsOn"] = list(request["dependsOn"])
+        return batch_request
+
+    # A request sent again only depends on the requests sent again with it, the others have succeeded
+    @staticmethod
+    def _depending_on(batch_request: dict, retried: set) -> dict:
+        if "dependsOn" not in batch_request:
+            return batch_request
+        batch_request = dict(batch_request)
+        batch_request["dependsOn"] = [request_id for request_id in batch_request["dependsOn"] if request_id in retried]
+        if not batch_request["dependsOn"]:
+            del batch_request["dependsOn"]
+        return batch_request
+
+    async def _get_token(self):
+        if self._access_token is None or self._access_token.expires_on - 300 < time.time():
+            # The azure.identity credential is synchronous, keep its network call off the event loop
+            self._access_token = await asyncio.to_thread(self.credential.get_token, GRAPH_SCOPE)
+        return self._access_token.token
+
+
+# Seconds from the Retry-After header of a throttled response (the batch or one of its items),
+# exponential backoff when Graph did not send one
+def retry_after_seconds(headers, attempt: int) -> float:
+    try:
+        return float(headers.get("Retry-After") or headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return float(min(2 ** attempt, 60))
+
+
+def batch_error_message(response: dict) -> str:
+    error = response.get("body", {}).get("error", {}) if isinstance(response.get("body"), dict) else {}
+    return f"{error.get('code', 'HTTP ' + str(response['status']))} - {error.get('message', '')}".strip(" -")
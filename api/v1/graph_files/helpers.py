@@ -1,7 +1,6 @@
 import random
 import string
 from configparser import SectionProxy
-import pandas as pd
 import re
 from .singletons import GraphServiceClientSingleton
 
@@ -22,6 +21,17 @@ class Helpers:
     def __init__(self,config:SectionProxy):
         self.app_client = GraphServiceClientSingleton.get_instance()
 
+# Yields each page of a Graph collection, following @odata.nextLink until the last page.
+# The request configuration is reused for the follow-up pages so headers such as ConsistencyLevel
+# are kept; the query parameters themselves are already encoded in the next link.
+async def iterate_graph_pages(request_builder, request_config):
+    page = await request_builder.get(request_configuration=request_config)
+    while page is not None:
+        yield page
+        if not page.odata_next_link:
+            break
+        page = await request_builder.with_url(page.odata_next_link).get(request_configuration=request_config)
+
 def convert_key(key):
     sliced_key = key.split('_', 2)[-1]
     converted_key = re.sub(r'_', ' ', sliced_key)
@@ -1,26 +1,26 @@
+import asyncio
 from configparser import SectionProxy
 from azure.identity.aio import ClientSecretCredential
 import re
 import copy
-from azure.cosmos import CosmosClient
 from msgraph import GraphServiceClient
-from msgraph.generated.applications.get_available_extension_properties import \
-    get_available_extension_properties_post_request_body
 from msgraph.generated.models.extension_property import ExtensionProperty
 from msgraph.generated.models.schema_extension import SchemaExtension
-from .singletons import GraphServiceClientSingleton,CosmosServiceClientSingleton
+from .singletons import GraphServiceClientSingleton
+from .repository import CosmosRepository
+from .extension_catalog import ExtensionCatalog
+from .tenant_manifest import TenantManifestCache
+from .throttling import AdaptiveConcurrencyLimiter, call_with_backoff
 
 class Institute:
     settings: SectionProxy
     client_credential: ClientSecretCredential
     app_client: GraphServiceClient
-    cosmos_client:CosmosClient
+    repository: CosmosRepository
 
     def __init__(self, config: SectionProxy):
         self.settings = config
-        self.cosmos_client = CosmosServiceClientSingleton.get_instance()
-        self.db = self.cosmos_client.get_database_client('courses_manipal')
-        self.container = self.db.get_container_client('courses_manipal')
+        self.repository = CosmosRepository('courses_manipal', 'courses_manipal')
         self.app_client = GraphServiceClientSingleton.get_instance()
 
     async def fetch_extensions_student_graph(self):
@@ -29,46 +29,18 @@ class Institute:
             sliced_key = key.split('_', 2)[-1]
             converted_key = re.sub(r'_', ' ', sliced_key)
             return converted_key
-        extension_request_body = get_available_extension_properties_post_request_body.GetAvailableExtensionPropertiesPostRequestBody()
-        extension_request_body.is_synced_from_on_premises = False
-        result = await self.app_client.directory_objects.get_available_extension_properties.post(
-            extension_request_body)
         extension_properties =[]
-        for value in result.value:
-            if value.name[10:42] == re.sub("-", "", application_id):
-                extension_properties.append({"Name": convert_key(value.name), "ID": value.id, "data_type": value.data_type})
+        for value in await ExtensionCatalog.get_instance().get_properties(application_id):
+            extension_properties.append({"Name": convert_key(value["name"]), "ID": value["id"], "data_type": value["data_type"]})
         return extension_properties
     
     async def fetch_extensions_student_manifest(self):
-        query = """
-            SELECT c.students.student_identifiers
-            FROM c
-            WHERE c.id = @tenant_id
-        """
-        parameters = [{"name": "@tenant_id", "value": self.settings['tenantId']}]
-        query_result = list(self.container.query_items(
-            query=query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
-        return query_result[0]["student_identifiers"]
-        
+        return await TenantManifestCache.get_instance(self.settings['tenantId']).get_section(
+            'students', 'student_identifiers')
 
     async def fetch_extensions_course_manifest(self):
-        query = """
-            SELECT c.courses.course_identifiers
-            FROM c
-            WHERE c.id = @tenant_id
-        """
-    
-        # Setting the query parameters
-        parameters = [{"name": "@tenant_id", "value": self.settings['tenantId']}]
-        query_result = list(self.container.query_items(
-            query=query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
-        return query_result[0]["course_identifiers"]
+        return await TenantManifestCache.get_instance(self.settings['tenantId']).get_section(
+            'courses', 'course_identifiers')
 
     async def fetch_extensions_course_graph(self):
         application_id = self.settings['course_dir_app']
@@ -76,14 +48,9 @@ class Institute:
             sliced_key = key.split('_', 2)[-1]
             converted_key = re.sub(r'_', ' ', sliced_key)
             return converted_key
-        extension_request_body = get_available_extension_properties_post_request_body.GetAvailableExtensionPropertiesPostRequestBody()
-        extension_request_body.is_synced_from_on_premises = False
-        result = await self.app_client.directory_objects.get_available_extension_properties.post(
-            extension_request_body)
         extension_properties =[]
-        for value in result.value:
-            if value.name[10:42] == re.sub("-", "", application_id):
-                extension_properties.append({"Name": convert_key(value.name), "ID": value.id, "data_type": value.data_type})
+        for value in await ExtensionCatalog.get_instance().get_properties(application_id):
+            extension_properties.append({"Name": convert_key(value["name"]), "ID": value["id"], "data_type": value["data_type"]})
         return extension_properties
 
     async def create_course_property(self,property_name):
@@ -94,7 +61,7 @@ class Institute:
         request_body.target_objects = (['Group', ])
         result = await self.app_client.applications.by_application_id(object_id).extension_properties.post(
             request_body)
-        pass
+        ExtensionCatalog.get_instance().invalidate()
 
     async def create_student_property(self,property_name):
         object_id = self.settings['stu_dir_obj']
@@ -104,58 +71,116 @@ class Institute:
         request_body.target_objects = (['User', ])
         result = await self.app_client.applications.by_application_id(object_id).extension_properties.post(
             request_body)
-        pass
+        ExtensionCatalog.get_instance().invalidate()
     
     async def delete_student_properties(self,property_ids:list):
         obj_id = self.settings['stu_dir_obj']
         for property_id in property_ids:
             await self.app_client.applications.by_application_id(obj_id).extension_properties.by_extension_property_id(property_id).delete()
+        ExtensionCatalog.get_instance().invalidate()
 
     async def delete_course_properties(self,property_ids:list):
         obj_id = self.settings['course_dir_obj']
         for property_id in property_ids:
             await self.app_client.applications.by_application_id(obj_id).extension_properties.by_extension_property_id(property_id).delete()
+        ExtensionCatalog.get_instance().invalidate()
             
-    async def institute_setup_runtime(self):
-        manifest  = self.container.read_item(partition_key = self.settings['tenantId'], item = self.settings['tenantId'])
+    # Creates the directory extension property of one manifest identifier unless it exists already.
+    # A property created by an earlier run that stopped before its checkpoint is found in the
+    # extension catalog (or reported as a conflict by Graph) and adopted instead of duplicated.
+    async def _ensure_extension_property(self, limiter, object_id, application_id, identifier, target_object,
+                                         data_type=None):
+        name = re.sub(r'\s', '_', identifier["name"])
+        extension_name = f"extension_{re.sub('-', '', application_id.strip())}_{name}"
+        catalog = ExtensionCatalog.get_instance()
+        for value in await catalog.get_properties(application_id):
+            if value["name"] == extension_name:
+                return value["id"], value["name"]
+        request_body = ExtensionProperty()
+        request_body.name = name
+        request_body.target_objects = ([target_object, ])
+        if data_type is not None:
+            request_body.data_type = data_type
+        try:
+            result = await call_with_backoff(
+                limiter, lambda: self.app_client.applications.by_application_id(object_id).extension_properties.post(request_body))
+        except Exception as e:
+            if getattr(e, "response_status_code", None) not in (400, 409):
+                raise
+            catalog.invalidate()
+            for value in await catalog.get_properties(application_id):
+                if value["name"] == extension_name:
+                    return value["id"], value["name"]
+            raise
+        return result.id, result.name
+
+    @staticmethod
+    def _extension_data_type(identifier):
+        if identifier["data_type"] in ["String", "enum", "struct"]:
+            return 'String'
+        elif identifier["data_type"] in ["Boolean", "DateTime", "Integer"]:
+            return identifier['data_type']
+        return 'String'
+
+    # Renders the institute manifest: creates the extension properties of the primary role and of every
+    # course and student identifier, then the enum values. Properties are created concurrently under an
+    # adaptive limit and each dir_ext_id is patched into the stored manifest as soon as it exists, so a
+    # run that fails part way resumes from its checkpoints and never creates a property twice.
+    async def institute_setup_runtime(self, max_concurrency: int = 8):
+        tenant_id = self.settings['tenantId']
+        manifest  = await self.repository.read_item(tenant_id, partition_key = tenant_id)
         course_obj_id = self.settings['course_dir_obj']
         stu_obj_id = self.settings['stu_dir_obj']
+        course_app_id = self.settings['course_dir_app']
+        stu_app_id = self.settings['stu_dir_app']
         rendered_manifest = copy.deepcopy(manifest)
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=min(4, max_concurrency), max_limit=max_concurrency)
+
+        # (manifest path, identifier, application object id, application id, target object, data type)
+        pending = []
     # Roles setup TODO
         # Render primary role definition
-        if manifest['institute']['primary_role']['dir_ext_id'] is None:
-            primary_role = manifest["institute"]["primary_role"]
-            request_body = ExtensionProperty()
-            request_body.name = re.sub(r'\s', '_', primary_role["name"])
-            request_body.target_objects = (['User',])
-            result = await self.app_client.applications.by_application_id(stu_obj_id).extension_properties.post(request_body)
-            rendered_manifest["institute"]["primary_role"]["dir_ext_id"] = result.id
-            rendered_manifest["institute"]["primary_role"]["dir_ext_name"] = result.name
-
-        
+        primary_role = rendered_manifest["institute"]["primary_role"]
+        if primary_role.get('dir_ext_id') is None:
+            pending.append(("/institute/primary_role", primary_role, stu_obj_id, stu_app_id, 'User', None))
 
     # Courses
-        # Check if courses render was successful
-        if manifest["courses"]["render_status"] == "complete":
-            pass
-        else:
-        # Course property augmentation
-            
-            for course_identifier in rendered_manifest["courses"]["course_identifiers"]:
-                if course_identifier["data_type"] in ["String", "enum", "struct"]:
-                    data_type = 'String'
-                elif course_identifier["data_type"] in ["Boolean", "DateTime", "Integer"]:
-                    data_type = course_identifier['data_type']
-                else:
-                    data_type = 'String'
-                request_body = ExtensionProperty()
-                request_body.name = re.sub(r'\s', '_', course_identifier["name"])
-                request_body.target_objects = (['Group', ])
-                request_body.data_type = data_type
-                result = await self.app_client.applications.by_application_id(course_obj_id).extension_properties.post(request_body)
-                course_identifier["dir_ext_id"] = result.id
-                course_identifier["dir_ext_name"] = result.name
-
+        # Course property augmentation, unless the courses render was already completed
+        if manifest["courses"]["render_status"] != "complete":
+            for position, course_identifier in enumerate(rendered_manifest["courses"]["course_identifiers"]):
+                if course_identifier.get("dir_ext_id") is None:
+                    pending.append((f"/courses/course_identifiers/{position}", course_identifier, course_obj_id,
+                                    course_app_id, 'Group', self._extension_data_type(course_identifier)))
+
+    # Students
+        # Student property augmentation, unless the students render was already completed
+        if manifest["students"]["render_status"] != "complete":
+            for position, student_identifier in enumerate(rendered_manifest["students"]["student_identifiers"]):
+                if student_identifier.get("dir_ext_id") is None:
+                    pending.append((f"/students/student_identifiers/{position}", student_identifier, stu_obj_id,
+                                    stu_app_id, 'User', self._extension_data_type(student_identifier)))
+
+        async def render_property(path, identifier, object_id, application_id, target_object, data_type):
+            dir_ext_id, dir_ext_name = await self._ensure_extension_property(
+                limiter, object_id, application_id, identifier, target_object, data_type)
+            identifier["dir_ext_id"] = dir_ext_id
+            identifier["dir_ext_name"] = dir_ext_name
+            # Checkpoint, a later run skips this identifier
+            await self.repository.patch_item(tenant_id, [
+                {"op": "set", "path": f"{path}/dir_ext_id", "value": dir_ext_id},
+                {"op": "set", "path": f"{path}/dir_ext_name", "value": dir_ext_name},
+            ], partition_key=tenant_id)
+
+        results = await asyncio.gather(*(render_property(*property_spec) for property_spec in pending), return_exceptions=True)
+        if pending:
+            ExtensionCatalog.get_instance().invalidate()
+            TenantManifestCache.get_instance(tenant_id).invalidate()
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            # The created properties are checkpointed, running the setup again resumes from here
+            raise errors[0]
+
+        if manifest["courses"]["render_status"] != "complete":
             # Enum rendering
             rendered_manifest['courses']['course_identifiers'][4]['enum_vals'] = [dept['identifier'] for dept in manifest['Institute']['academic_department_definitions'] if 'identifier' in dept]
             rendered_manifest['courses']['course_identifiers'][7]['enum_vals'] = [dept['name'] for dept in manifest['Institute']['academic_department_definitions'] if 'name' in dept]
@@ -163,39 +188,12 @@ class Institute:
             rendered_manifest['courses']['course_identifiers'][10]['enum_vals'] = [course_type['name'] for course_type in manifest['Courses']['course_type_definitions'] if 'name' in course_type]
             rendered_manifest['courses']['render_status'] = 'complete'
 
-        # Students
-        # Check if courses render was successful
-        if manifest["students"]["render_status"] == "complete":
-            pass
-        else:
-        # Student property augmentation
-            
-            for student_identifier in rendered_manifest["students"]["student_identifiers"]:
-                if student_identifier["data_type"] in ["String", "enum", "struct"]:
-                    data_type = 'String'
-                elif student_identifier["data_type"] in ["Boolean", "DateTime", "Integer"]:
-                    data_type = student_identifier['data_type']
-                else:
-                    data_type = 'String'
-                request_body = ExtensionProperty()
-                request_body.name = re.sub(r'\s', '_', student_identifier["name"])
-                request_body.target_objects = (['User', ])
-                request_body.data_type = data_type
-                result = await self.app_client.applications.by_application_id(stu_obj_id).extension_properties.post(request_body)
-                student_identifier["dir_ext_id"] = result.id
-                student_identifier["dir_ext_name"] = result.name
-
+        if manifest["students"]["render_status"] != "complete":
             # Enum rendering
             rendered_manifest['students']['student_identifiers'][1]['enum_vals'] = [dept['name'] for dept in manifest['institute']['academic_department_definitions'] if 'name' in dept]
             rendered_manifest['students']['student_identifiers'][0]['enum_vals'] = [program['name'] for department in manifest["institute"]["academic_department_definitions"] for program in department["programs"]]
             rendered_manifest['students']['render_status'] = 'complete'
-        self.container.upsert_item(rendered_manifest)
+        await self.repository.upsert_item(rendered_manifest)
+        ExtensionCatalog.get_instance().invalidate()
+        TenantManifestCache.get_instance(tenant_id).invalidate()
         return rendered_manifest
-    
-            
-
-
-
-
-
-    
\ No newline at end of file
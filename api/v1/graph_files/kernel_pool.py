@@ -0,0 +1,44 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+# Fixed size pool of pre-built objects (the copilot keeps semantic kernels in it), borrowed for
+# the length of one request. Everything is built by factory in one go on first use or on warm(),
+# so the per request cost is a queue get and put. Requests wait for a free entry when every one
+# of them is lent out, which also bounds how many copilot asks run at once.
+class KernelPool:
+    def __init__(self, factory, size: int = 4):
+        self.factory = factory
+        self.size = size
+        self.borrowed = 0
+        self.waits = 0
+        self._idle = None
+        self._lock = asyncio.Lock()
+
+    async def warm(self):
+        async with self._lock:
+            if self._idle is None:
+                idle = asyncio.Queue()
+                for _ in range(self.size):
+                    idle.put_nowait(self.factory())
+                self._idle = idle
+
+    @asynccontextmanager
+    async def borrow(self):
+        if self._idle is None:
+            await self.warm()
+        if self._idle.empty():
+            self.waits += 1
+        entry = await self._idle.get()
+        self.borrowed += 1
+        try:
+            yield entry
+        finally:
+            self._idle.put_nowait(entry)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize() if self._idle is not None else 0,
+            "borrowed": self.borrowed,
+            "waits": self.waits,
+        }
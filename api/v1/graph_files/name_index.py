@@ -0,0 +1,104 @@
+import asyncio
+import time
+from collections import Counter, defaultdict
+
+from fuzzywuzzy import fuzz
+
+
+def trigrams(text: str) -> set:
+    padded = "  " + " ".join(text.lower().split()) + " "
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+# In-process index of the names of a roster (students or courses) for resolving the misspelled or
+# partial names of a copilot ask to records. Candidates come from a character trigram index and are
+# ranked with fuzzywuzzy's WRatio, which also scores "Lance" against "Lance Barreto" well. A match
+# is ambiguous when its score is under min_score or a runner up is within ambiguity_margin of it
+# ("Karthik" with two Karthiks on the roster); only those need the LLM.
+#
+# The roster is loaded with loader on first use and reloaded after refresh_interval seconds, and a
+# reload only touches the entries that changed. The services also upsert and remove entries as
+# they create and delete records, so new names resolve before the next reload.
+class NameIndex:
+    def __init__(self, loader, id_key: str, refresh_interval: int = 300, min_score: int = 85,
+                 ambiguity_margin: int = 5, min_candidate_score: int = 60, max_candidates: int = 25):
+        self.loader = loader
+        self.id_key = id_key
+        self.refresh_interval = refresh_interval
+        self.min_score = min_score
+        self.ambiguity_margin = ambiguity_margin
+        self.min_candidate_score = min_candidate_score
+        self.max_candidates = max_candidates
+        self.names = {}
+        self._postings = defaultdict(set)
+        self._loaded_at = None
+        self._lock = asyncio.Lock()
+
+    def upsert(self, record_id: str, name: str):
+        previous = self.names.get(record_id)
+        if previous == name:
+            return
+        if previous is not None:
+            self._unindex(record_id, previous)
+        self.names[record_id] = name
+        for gram in trigrams(name):
+            self._postings[gram].add(record_id)
+
+    def remove(self, record_id: str):
+        name = self.names.pop(record_id, None)
+        if name is not None:
+            self._unindex(record_id, name)
+
+    def _unindex(self, record_id: str, name: str):
+        for gram in trigrams(name):
+            postings = self._postings.get(gram)
+            if postings is not None:
+                postings.discard(record_id)
+                if not postings:
+                    del self._postings[gram]
+
+    async def refresh(self):
+        async with self._lock:
+            await self._reload()
+
+    async def _reload(self):
+        records = await self.loader()
+        current = {record[self.id_key]: record['name'] for record in records if record.get('name')}
+        for record_id in set(self.names) - set(current):
+            self.remove(record_id)
+        for record_id, name in current.items():
+            self.upsert(record_id, name)
+        self._loaded_at = time.monotonic()
+
+    def _stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval
+
+    async def ensure_fresh(self):
+        if self._stale():
+            async with self._lock:
+                if self._stale():
+                    await self._reload()
+
+    # Returns {"query", "id", "name", "score", "ambiguous", "candidates"} where candidates are the
+    # best few {"id", "name", "score"}; id and name are None when nothing on the roster scores
+    # min_candidate_score
+    def lookup(self, query: str) -> dict:
+        overlap = Counter()
+        for gram in trigrams(query):
+            for record_id in self._postings.get(gram, ()):
+                overlap[record_id] += 1
+        scored = sorted(((fuzz.WRatio(query, self.names[record_id]), record_id)
+                         for record_id, _ in overlap.most_common(self.max_candidates)), reverse=True)
+        candidates = [{"id": record_id, "name": self.names[record_id], "score": score}
+                      for score, record_id in scored[:5] if score >= self.min_candidate_score]
+        if not candidates:
+            return {"query": query, "id": None, "name": None, "score": 0, "ambiguous": False, "candidates": []}
+        best = candidates[0]
+        runner_up = candidates[1]["score"] if len(candidates) > 1 else 0
+        ambiguous = best["score"] < self.min_score or best["score"] - runner_up < self.ambiguity_margin
+        return {"query": query, "id": best["id"], "name": best["name"], "score": best["score"],
+                "ambiguous": ambiguous, "candidates": candidates}
+
+    async def resolve(self, queries: list) -> list:
+        await self.ensure_fresh()
+        return [self.lookup(query) for query in queries]
@@ -1,33 +1,20 @@
 from configparser import SectionProxy
-from .singletons import CosmosServiceClientSingleton,AsyncAzureOpenAIClientSingleton
+from .singletons import AsyncAzureOpenAIClientSingleton
+from .repository import CosmosRepository
+from .commentary_cache import CommentaryCache, commentary_key
+from . import copilot_stream
+from .prompt_compaction import compact_attendance, count_tokens, EXACT_TOKEN_COUNTS
 import json
-import configparser
-from ..graph_files.students import Students
-from ..graph_files.courses import Courses
-from ..graph_files.institute import Institute
 import re
-config = configparser.ConfigParser()
-config.read(['config.cfg', 'config.dev.cfg'])
-azure_settings = config['azure']
 
-students_instance = Students(azure_settings)
-institute_instance = Institute(azure_settings)
-courses_instance = Courses(azure_settings)
-
-class OpenAI:
-    settings: SectionProxy
-    
-
-    def __init__(self, config:SectionProxy):
-        self.settings = config
-        self.cosmos_client = CosmosServiceClientSingleton.get_instance()
-        self.db = self.cosmos_client.get_database_client('courses_manipal')
-        self.container = self.db.get_container_client('courses_manipal')
-        self.openai_client = AsyncAzureOpenAIClientSingleton.get_azure_openai_client()
-    
-    async def get_attendance_commentary(self, attendance):
-        max_completion_tokens = 2048
-        system_prompt = """ You will be given an attendance dataset. This dataset can either be relevant to a particular student (or set of students) or a particular course (or set of courses).
+# Bump COMMENTARY_PROMPT_VERSION with any change to the prompt or to how the attendance is
+# compacted into it, cached commentaries are keyed by it
+COMMENTARY_PROMPT_VERSION = 3
+COMMENTARY_MODEL = "gpt-3.5-turbo"
+# Tokens the compacted attendance may take, what is left of the 4k context of the model after the
+# instructions and the 2048 completion tokens
+COMMENTARY_DATA_TOKEN_BUDGET = 1500
+COMMENTARY_PROMPT = """ You will be given an attendance dataset. This dataset can either be relevant to a particular student (or set of students) or a particular course (or set of courses).
         You need to offer particular insights on the performance of the students/course based on this data. Here are some assumptions you have to make:
         Assume that the dataset is complete. Dont give a response like "I cannot comment due to the data being incomplete or not having a full range
         Assume that the dataset contains all enrolled students (In case of course related attendance data)
@@ -39,22 +26,80 @@ class OpenAI:
         
         You need to offer insights to answer the following questions?
         1) How is the student/students performing in the courses enrolled for each student asked
+
+        The dataset is a summary: a line per course, then a table with a row per student and course giving the attendance
+        percentage, the change of the recent sessions against the overall percentage, the longest run of absences, the run
+        the record ends with (A3 means absent the last three sessions) and the dates of the runs of two or more absences.
         
         format your response using markdown to look good with a single title header."""
+
+class OpenAI:
+    settings: SectionProxy
+    
+
+    def __init__(self, config:SectionProxy):
+        self.settings = config
+        self.repository = CosmosRepository('courses_manipal', 'courses_manipal')
+        self.openai_client = AsyncAzureOpenAIClientSingleton.get_azure_openai_client()
+        # Tokens of the commentary prompts sent, and what they would have been with the raw records.
+        # Served by GET /copilot/commentary-prompts.
+        self.prompt_tokens = {"prompts": 0, "raw": 0, "compacted": 0}
+    
+    # course_ids are the courses the attendance was taken from. The commentary is cached until the
+    # attendance of one of them changes.
+    async def get_attendance_commentary(self, attendance, course_ids=()):
+        cache = CommentaryCache.get_instance()
+        key = commentary_key(attendance, COMMENTARY_PROMPT_VERSION, COMMENTARY_MODEL)
+        commentary = await cache.get(key)
+        if commentary is not None:
+            copilot_stream.emit("token", {"text": commentary})
+            return commentary
+
+        max_completion_tokens = 2048
+        system_prompt = COMMENTARY_PROMPT
         
-        prompt = "START SYSTEM PROMPT" +  " " + system_prompt + " " + "END SYSTEM PROMPT AND START ATTENDANCE DATA" + " "+ str(attendance) + " " +  "ATTENDANCE DATA ENDED" +" "+  "Response: "
-        print(system_prompt)
+        def build_prompt(attendance_data: str) -> str:
+            return "START SYSTEM PROMPT" +  " " + system_prompt + " " + "END SYSTEM PROMPT AND START ATTENDANCE DATA" + " "+ attendance_data + " " +  "ATTENDANCE DATA ENDED" +" "+  "Response: "
+        prompt = build_prompt(compact_attendance(attendance, COMMENTARY_DATA_TOKEN_BUDGET))
+        # What the prompt would have cost with the raw records embedded, for comparison
+        raw_tokens = count_tokens(build_prompt(str(attendance)))
+        compacted_tokens = count_tokens(prompt)
+        self.prompt_tokens["prompts"] += 1
+        self.prompt_tokens["raw"] += raw_tokens
+        self.prompt_tokens["compacted"] += compacted_tokens
+        streamed = copilot_stream.streaming()
         response = await self.openai_client.chat.completions.create(
         messages=[{"role": "user", "content": prompt}],
-        model = "gpt-3.5-turbo",
+        model = COMMENTARY_MODEL,
         max_tokens=max_completion_tokens,
         temperature=0,
         top_p=1,
         frequency_penalty=0,
-        presence_penalty=0
+        presence_penalty=0,
+        stream=streamed
         )
 
-        return response.choices[0].message.content
+        if streamed:
+            # Tokens go out to the copilot stream as they arrive; Azure opens with a chunk without choices
+            parts = []
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    copilot_stream.emit("token", {"text": chunk.choices[0].delta.content})
+            commentary = "".join(parts)
+        else:
+            commentary = response.choices[0].message.content
+        await cache.put(key, commentary, course_ids)
+        return commentary
+
+    def prompt_stats(self):
+        raw, compacted = self.prompt_tokens["raw"], self.prompt_tokens["compacted"]
+        return {
+            **self.prompt_tokens,
+            "exact_counts": EXACT_TOKEN_COUNTS,
+            "saved": raw - compacted,
+            "ratio": raw / compacted if compacted else 0.0,
+        }
         
             
 
@@ -0,0 +1,181 @@
+import json
+import re
+import time
+from collections import OrderedDict
+
+# Words that start or glue together a question, or name what the skills work on; capitalized,
+# they are still not entity names
+NON_ENTITY_WORDS = {
+    "a", "all", "an", "and", "are", "as", "at", "by", "can", "compare", "could", "did", "do", "does",
+    "find", "for", "from", "get", "give", "how", "i", "in", "is", "list", "me", "of", "on", "or",
+    "please", "show", "tell", "the", "to", "what", "which", "who", "whose", "why", "with",
+    "attendance", "count", "course", "courses", "insights", "institute", "student", "students",
+}
+QUOTED = re.compile(r"\"([^\"]+)\"|(?<!\w)'([^']+)'(?!\w)")
+CAPITALIZED_RUN = re.compile(r"\b[A-Z][\w.'-]*(?:\s+[A-Z][\w.'-]*)*")
+NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+
+def placeholder(position: int) -> str:
+    return "{{entity_%d}}" % position
+
+
+# Splits an ask into a template and the entity values abstracted out of it, numbered in order:
+# "Attendance of Karthik Prabhu and Lance" -> ("attendance of {{entity_0}} and {{entity_1}}",
+# ["Karthik Prabhu", "Lance"]). Entities are quoted strings, runs of capitalized words and numbers.
+def normalize_ask(ask: str):
+    spans = []
+
+    def free(start, end):
+        return all(end <= taken_start or start >= taken_end for taken_start, taken_end, _ in spans)
+
+    for match in QUOTED.finditer(ask):
+        spans.append((match.start(), match.end(), match.group(1) or match.group(2)))
+    for match in CAPITALIZED_RUN.finditer(ask):
+        words = match.group(0).split()
+        # Leading question words ("Show", "How") stay part of the template
+        while words and words[0].lower() in NON_ENTITY_WORDS:
+            words.pop(0)
+        start = match.end() - len(" ".join(words))
+        if words and free(start, match.end()):
+            spans.append((start, match.end(), " ".join(words)))
+    for match in NUMBER.finditer(ask):
+        if free(match.start(), match.end()):
+            spans.append((match.start(), match.end(), match.group(0)))
+
+    parts = []
+    entities = []
+    position = 0
+    for start, end, value in sorted(spans):
+        parts.append(ask[position:start].lower())
+        parts.append(placeholder(len(entities)))
+        entities.append(value)
+        position = end
+    parts.append(ask[position:].lower())
+    template = " ".join("".join(parts).split()).rstrip("?.! ")
+    return template, entities
+
+
+# LRU cache of copilot plans keyed by the normalized ask. The plan of one ask is stored with its
+# entity values replaced by placeholders, and a later ask with the same template gets the plan back
+# with its own entities bound in, without an LLM planning round trip. Entities are only replaced in
+# the input and the args of the plan, never in the functions it calls. A plan is not cached when it
+# cannot be rebound safely: it does not mention every entity of its ask (the planner reworded a
+# name, say), or an entity shows up in a function name and so may have decided which one is called.
+#
+# The kind of every entity is part of the key, since it decides the plan: "attendance of Karthik
+# Prabhu" calls the student skills and "attendance of Computer Networks" the course skills. Numbers
+# are of kind "number", names get theirs from classify, an async callable returning the kind of a
+# name ("student", "course") or None. Asks with an entity of no known kind are never cached.
+class PlanCache:
+    def __init__(self, classify=None, max_entries: int = 256, ttl: int = 3600):
+        self.classify = classify
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    # (template, kinds of its entities), None when an entity is of no known kind
+    async def _key(self, ask: str):
+        template, entities = normalize_ask(ask)
+        kinds = []
+        for entity in entities:
+            if NUMBER.fullmatch(entity):
+                kinds.append("number")
+                continue
+            kind = await self.classify(entity) if self.classify is not None else None
+            if kind is None:
+                return None, entities
+            kinds.append(kind)
+        return (template, tuple(kinds)), entities
+
+    # Returns the plan JSON for the ask, or None when the template is not cached
+    async def get(self, ask: str):
+        key, entities = await self._key(ask)
+        entry = self._entries.get(key) if key is not None else None
+        if entry is not None:
+            expires_at, plan_template = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.dumps(self._map_values(plan_template, lambda value: self._bind(value, entities)))
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    # plan is the raw planner output, the JSON text BasicPlanner.execute_plan parses. Returns
+    # whether the plan was cached.
+    async def put(self, ask: str, plan: str) -> bool:
+        key, entities = await self._key(ask)
+        plan_template = self._templatize(plan, entities) if key is not None else None
+        if plan_template is None:
+            self.uncacheable += 1
+            return False
+        self._entries[key] = (time.monotonic() + self.ttl, plan_template)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return True
+
+    def _templatize(self, plan: str, entities: list):
+        try:
+            # The planner may wrap the JSON in prose
+            plan_data = json.loads(plan[plan.index("{"):plan.rindex("}") + 1])
+            functions = " ".join(subtask["function"] for subtask in plan_data["subtasks"]).lower()
+        except (ValueError, KeyError, TypeError):
+            return None
+        if any(entity.lower() in functions for entity in entities):
+            return None
+        # Longest first, so an entity contained in another one does not split it
+        patterns = [(re.compile(r"(?<!\w)" + re.escape(entities[position]) + r"(?!\w)"), placeholder(position))
+                    for position in sorted(range(len(entities)), key=lambda position: -len(entities[position]))]
+        found = set()
+
+        def abstract(value: str) -> str:
+            for pattern, entity_placeholder in patterns:
+                value, replaced = pattern.subn(entity_placeholder, value)
+                if replaced:
+                    found.add(entity_placeholder)
+            return value
+
+        plan_template = self._map_values(plan_data, abstract)
+        if len(found) != len(entities):
+            return None
+        return plan_template
+
+    # Applies function to the string values of the plan's input and subtask args
+    @staticmethod
+    def _map_values(plan_data: dict, function):
+        mapped = dict(plan_data)
+        if isinstance(mapped.get("input"), str):
+            mapped["input"] = function(mapped["input"])
+        mapped["subtasks"] = []
+        for subtask in plan_data["subtasks"]:
+            subtask = dict(subtask)
+            if isinstance(subtask.get("args"), dict):
+                subtask["args"] = {key: function(value) if isinstance(value, str) else value
+                                   for key, value in subtask["args"].items()}
+            mapped["subtasks"].append(subtask)
+        return mapped
+
+    @staticmethod
+    def _bind(value: str, entities: list) -> str:
+        return re.sub(r"\{\{entity_(\d+)\}\}", lambda match: entities[int(match.group(1))], value)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,156 @@
+from .attendance import PRESENT, ABSENT, LOW_ATTENDANCE_THRESHOLD, date_sort_key, attendance_percentage
+
+# Exact counts with the gpt-3.5-turbo tokenizer when tiktoken is installed, otherwise the usual
+# four characters per token estimate
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+EXACT_TOKEN_COUNTS = _encoding is not None
+
+# Sessions the recent trend is taken over
+RECENT_SESSIONS = 10
+# Absence clusters listed per row, longest first
+MAX_CLUSTERS = 3
+
+HEADER = (f"Student | Course | Attendance | Present/Total | Last {RECENT_SESSIONS} vs overall | Longest absence run | "
+          "Current run | Absence clusters")
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# Statistics of one {date: status} record: percentage, the recent trend in percentage points, the
+# longest run of absences, the run the record ends with ("A3" is three absences in a row) and the
+# runs of two or more absences as (first date, last date, length)
+def summarize_record(record: dict) -> dict:
+    dates = sorted(record, key=date_sort_key)
+    statuses = [record[date] for date in dates]
+    counts = (statuses.count(PRESENT), statuses.count(ABSENT), len(statuses))
+    percentage = attendance_percentage(counts)
+    recent = statuses[-RECENT_SESSIONS:]
+    trend = 0.0
+    if len(statuses) > RECENT_SESSIONS:
+        trend = attendance_percentage((recent.count(PRESENT), recent.count(ABSENT), len(recent))) - percentage
+
+    clusters = []
+    run_start = None
+    for position, status in enumerate(statuses + [None]):
+        if status == ABSENT:
+            if run_start is None:
+                run_start = position
+        elif run_start is not None:
+            if position - run_start >= 2:
+                clusters.append((dates[run_start], dates[position - 1], position - run_start))
+            run_start = None
+
+    current_run = ""
+    if statuses:
+        length = 1
+        while length < len(statuses) and statuses[-length - 1] == statuses[-1]:
+            length += 1
+        current_run = f"{statuses[-1]}{length}"
+    return {
+        "percentage": percentage,
+        "present": counts[0],
+        "total": counts[2],
+        "trend": trend,
+        "longest_absence_run": max((status_run for *_, status_run in clusters),
+                                   default=1 if ABSENT in statuses else 0),
+        "current_run": current_run,
+        "absence_clusters": sorted(clusters, key=lambda cluster: -cluster[2]),
+    }
+
+
+# (student name, course name, {date: status}) for the two shapes the skills hand to the commentary:
+# students with their "student_attendance" per course, or courses with their "course_attendance"
+# per student in the legacy attendance_dates list
+def attendance_rows(attendance: list):
+    for entry in attendance:
+        if 'student_attendance' in entry:
+            for course in entry['student_attendance']:
+                yield entry['student_name'], course['course_name'], course['attendance_record']
+        else:
+            for student in entry['course_attendance']:
+                record = {}
+                for attendance_date in student['attendance_dates']:
+                    record.update(attendance_date)
+                yield student['student_name'], entry['course_name'], record
+
+
+def format_row(student_name: str, course_name: str, summary: dict, clusters: bool = True) -> str:
+    if summary['total'] == 0:
+        return f"{student_name} | {course_name} | no sessions"
+    if clusters:
+        absence_clusters = "; ".join(f"{first} to {last} ({length})"
+                                     for first, last, length in summary['absence_clusters'][:MAX_CLUSTERS]) or "none"
+        if len(summary['absence_clusters']) > MAX_CLUSTERS:
+            absence_clusters += f"; {len(summary['absence_clusters']) - MAX_CLUSTERS} more"
+    else:
+        absence_clusters = str(len(summary['absence_clusters']))
+    return (f"{student_name} | {course_name} | {summary['percentage']:.1f}% | {summary['present']}/{summary['total']} | "
+            f"{summary['trend']:+.1f} pts | {summary['longest_absence_run']} | {summary['current_run'] or '-'} | "
+            f"{absence_clusters}")
+
+
+# Students without any session yet are counted but left out of the mean and of the number under
+# the threshold, a 0 of 0 is no attendance figure
+def course_line(course_name: str, summaries: list) -> str:
+    if not summaries:
+        return f"{course_name}: no students enrolled"
+    attended = [summary['percentage'] for summary in summaries if summary['total']]
+    if not attended:
+        return f"{course_name}: {len(summaries)} students, no sessions recorded"
+    line = (f"{course_name}: {len(summaries)} students, mean attendance {sum(attended) / len(attended):.1f}%, "
+            f"{sum(percentage < LOW_ATTENDANCE_THRESHOLD for percentage in attended)} under {LOW_ATTENDANCE_THRESHOLD}%")
+    if len(attended) < len(summaries):
+        line += f", {len(summaries) - len(attended)} without sessions"
+    return line
+
+
+# Reduces the attendance handed to the commentary to one line of statistics per student and course,
+# with a line per course on top. When that is over token_budget, the absence clusters are cut to a
+# count and then the rows of the best attended students are folded into a single closing line,
+# so the students under LOW_ATTENDANCE_THRESHOLD are the last to go.
+def compact_attendance(attendance: list, token_budget: int) -> str:
+    rows = [(student_name, course_name, summarize_record(record))
+            for student_name, course_name, record in attendance_rows(attendance)]
+
+    # Courses asked about keep their line even without enrolled students
+    courses = {entry['course_name']: [] for entry in attendance if 'course_attendance' in entry}
+    for _, course_name, summary in rows:
+        courses.setdefault(course_name, []).append(summary)
+    course_lines = [course_line(course_name, summaries) for course_name, summaries in courses.items()]
+
+    for clusters in (True, False):
+        text = "\n".join(course_lines + [HEADER] + [format_row(*row, clusters=clusters) for row in rows])
+        if count_tokens(text) <= token_budget:
+            return text
+
+    # Worst attendance first and students without sessions last, then as many rows as fit
+    rows.sort(key=lambda row: (row[2]['total'] == 0, row[2]['percentage']))
+    text = "\n".join(course_lines + [HEADER])
+    used = count_tokens(text)
+    kept = 0
+    for row in rows:
+        line = format_row(*row, clusters=False)
+        line_tokens = count_tokens(line) + 1
+        # Room is left for the closing line
+        if used + line_tokens > token_budget - 30:
+            break
+        text += "\n" + line
+        used += line_tokens
+        kept += 1
+    if kept < len(rows):
+        folded = [row[2]['percentage'] for row in rows[kept:] if row[2]['total']]
+        text += f"\n{len(rows) - kept} more rows"
+        if folded:
+            text += (f", attendance between {min(folded):.1f}% and {max(folded):.1f}% "
+                     f"(mean {sum(folded) / len(folded):.1f}%)")
+        if len(folded) < len(rows) - kept:
+            text += f", {len(rows) - kept - len(folded)} without sessions"
+    return text
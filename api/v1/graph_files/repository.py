@@ -0,0 +1,47 @@
+from azure.cosmos.aio import ContainerProxy
+from .singletons import AsyncCosmosServiceClientSingleton
+
+# Cosmos accepts at most this many operations in a single patch request
+MAX_PATCH_OPERATIONS = 10
+
+# Course documents are the ones with a students list, the tenant manifest keeps a students object
+COURSE_DOCUMENTS_QUERY = "SELECT * FROM c WHERE IS_ARRAY(c.students)"
+
+# Async data access for a Cosmos container. Every call is awaited on the shared async client,
+# so a Cosmos round trip no longer blocks the event loop of the worker.
+class CosmosRepository:
+    container: ContainerProxy
+
+    def __init__(self, database_name: str = 'courses_manipal', container_name: str = 'courses_manipal'):
+        self.container = AsyncCosmosServiceClientSingleton.get_container(database_name, container_name)
+
+    async def read_item(self, item_id: str, partition_key: str = None, **kwargs) -> dict:
+        if partition_key is None:
+            partition_key = item_id
+        return await self.container.read_item(item=item_id, partition_key=partition_key, **kwargs)
+
+    async def create_item(self, body: dict) -> dict:
+        return await self.container.create_item(body)
+
+    async def replace_item(self, item_id: str, body: dict, **kwargs) -> dict:
+        return await self.container.replace_item(item=item_id, body=body, **kwargs)
+
+    async def upsert_item(self, body: dict, **kwargs) -> dict:
+        return await self.container.upsert_item(body, **kwargs)
+
+    # Partial document update, only the targeted paths travel over the wire
+    async def patch_item(self, item_id: str, patch_operations: list, partition_key: str = None, **kwargs) -> dict:
+        if partition_key is None:
+            partition_key = item_id
+        return await self.container.patch_item(item=item_id, partition_key=partition_key,
+                                               patch_operations=patch_operations, **kwargs)
+
+    async def query_items(self, query: str, parameters: list = None, partition_key: str = None) -> list:
+        # Without a partition key the async client fans the query out across partitions
+        items = self.container.query_items(query=query, parameters=parameters, partition_key=partition_key)
+        return [item async for item in items]
+
+    # Streams the results instead of collecting them, for queries over every document of the container
+    async def iter_items(self, query: str, parameters: list = None, partition_key: str = None):
+        async for item in self.container.query_items(query=query, parameters=parameters, partition_key=partition_key):
+            yield item
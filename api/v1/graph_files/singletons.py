@@ -2,10 +2,7 @@ from azure.identity import ClientSecretCredential
 from msgraph import GraphServiceClient
 from .config import read_azure_config
 from azure.cosmos import CosmosClient
-from openai import AsyncAzureOpenAI
-
-import semantic_kernel as sk
-from semantic_kernel.connectors.ai.open_ai import OpenAIChatCompletion, AzureChatCompletion
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
 
 azure_config = read_azure_config()
 
@@ -43,12 +40,41 @@ class CosmosServiceClientSingleton:
             cls._instance = CosmosClient(url,key)
         return cls._instance
 
+# One async client per worker so every repository shares its connection pool.
+# Container handles are cached too, they are cheap but there is no reason to rebuild them per request.
+class AsyncCosmosServiceClientSingleton:
+    _instance = None
+    _containers = {}
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            url = azure_config.get('YOUR_COSMOS_DB_URL')
+            key = azure_config.get('YOUR_COSMOS_DB_KEY')
+            cls._instance = AsyncCosmosClient(url,key)
+        return cls._instance
+
+    @classmethod
+    def get_container(cls, database_name, container_name):
+        if (database_name, container_name) not in cls._containers:
+            db = cls.get_instance().get_database_client(database_name)
+            cls._containers[(database_name, container_name)] = db.get_container_client(container_name)
+        return cls._containers[(database_name, container_name)]
+
+    @classmethod
+    async def close(cls):
+        if cls._instance is not None:
+            await cls._instance.close()
+            cls._instance = None
+            cls._containers = {}
+
 class AsyncAzureOpenAIClientSingleton:
     _instance = None
 
     @classmethod
     def get_azure_openai_client(cls):
         if cls._instance is None:
+            from openai import AsyncAzureOpenAI
             api_key = azure_config.get('openai_api_key')
             api_base = azure_config.get('openai_api_base')
             api_version = azure_config.get('openai_api_version')
@@ -4,25 +4,56 @@ from configparser import SectionProxy
 from .singletons import AsyncAzureOpenAIClientSingleton
 from ..graph_files.students import Students
 from ..graph_files.courses import Courses
-from ..graph_files.institute import Institute
-import configparser
 import json
 from ..graph_files.openai import OpenAI
-from fuzzywuzzy import process
 import ast
+import asyncio
 
 from . import helpers
-config = configparser.ConfigParser()
-config.read(['config.cfg', 'config.dev.cfg'])
-azure_settings = config['azure']
-students_instance = Students(azure_settings)
-institute_instance = Institute(azure_settings)
-courses_instance = Courses(azure_settings)
-openai_instance = OpenAI(azure_settings)
+from . import copilot_stream
+
+MEMBERSHIP_LOOKUP_CONCURRENCY = 8
+
+# The name extractors answer with a list literal, e.g. "['Karthik Prabhu','Lance Barreto']"
+def parse_name_list(name_list: str) -> list:
+    try:
+        names = ast.literal_eval(name_list.strip())
+    except (ValueError, SyntaxError):
+        names = name_list.strip().strip("[]").split(",")
+    if isinstance(names, str):
+        names = [names]
+    names = [str(name).strip().strip("'\"").strip() for name in names]
+    return [name for name in names if name]
+
+# Resolves the names against the roster's name index. Confident matches are taken as they are and
+# only the ambiguous ones go to llm_match, together with the shortlisted candidates of each of them
+# rather than the whole roster. Returns [{"name", id_key}] without duplicates, and the names nothing
+# on the roster came close to, which the answer reports as not found.
+async def resolve_names(name_index, name_list: str, id_key: str, llm_match):
+    matches = await name_index.resolve(parse_name_list(name_list))
+    not_found = [match["query"] for match in matches if not match["candidates"]]
+    matched_records = [{"name": match["name"], id_key: match["id"]}
+                       for match in matches if match["id"] is not None and not match["ambiguous"]]
+    ambiguous = [match for match in matches if match["ambiguous"]]
+    if ambiguous:
+        shortlist = {candidate["id"]: {"name": candidate["name"], id_key: candidate["id"]}
+                     for match in ambiguous for candidate in match["candidates"]}
+        matched_records.extend(await llm_match([match["query"] for match in ambiguous], list(shortlist.values())))
+    unique_records = {}
+    for record in matched_records:
+        unique_records.setdefault(record[id_key], record)
+    return list(unique_records.values()), not_found
+
+
+def not_found_note(kind: str, not_found: list) -> str:
+    return f"No {kind} found matching: {', '.join(not_found)}" if not_found else ""
 
 class StudentSkills:
     
-    def __init__(self):
+    def __init__(self, students: Students, courses: Courses, openai: OpenAI):
+        self.students = students
+        self.courses = courses
+        self.openai = openai
         self.openai_client = AsyncAzureOpenAIClientSingleton.get_azure_openai_client()
 
     @kernel_function(
@@ -31,7 +62,7 @@ class StudentSkills:
             name = "GetAllStudents",
         )
     async def get_all_students(self) -> str:
-        students = helpers.generate_md_table(await students_instance.get_all_students())
+        students = helpers.generate_md_table(await self.students.get_all_students())
         return students
     @kernel_function(
         input_description = "count students",
@@ -39,7 +70,7 @@ class StudentSkills:
         name = "GetAllStudentCount",
     )
     async def get_all_student_count(self) -> str:
-        students = await students_instance.get_all_students()
+        students = await self.students.get_all_students()
         count = len(students)
         return f"There are {count} students in the Institute"
     
@@ -70,19 +101,9 @@ class StudentSkills:
 
     
 
-    @kernel_function(
-        input_description = """ Student Attendance insights generator""",
-        description = """ Generates insights for the attendance of the list of students submitted to it. Here is what the planner must do. First, identify that the ask has an intent to collect attendance of students. Then, the planner must first use UniqueStudentNameExtractor to get the student name list. Then run StudentAttendanceInsightGenerator function for the insights""",
-        name = "StudentAttendanceInsightGenerator",
-    )
-    async def student_attendance_insight_generator(self,name_list:str) -> str:
-        # print(name_list)
-        full_records = await students_instance.get_all_students()
+    # Matches names the name index could not resolve confidently against the shortlisted records
+    async def match_names_with_llm(self, name_list: list, name_and_id_records: list) -> list:
         max_completion_tokens = 2048
-        name_and_id_records = []
-        for student in full_records:
-            name_and_id_records.append({"name": student['name'], "student_id": student["student_id"]})
-        # print(name_and_id_records)
         system_prompt = """ START SYSTEM PROMPT You will be given a list of names with variations. Use your intelligence to idenfity the unique records of the given names from the overall list.
             Example (Only for reference to understand the given schema):  START NAMES WITH VARIATIONS ['Karthik prabu','Lanc'] NAMES WITH VARIATIONS ENDED START OVERALL LIST [{
             "name": "Lance",
@@ -104,16 +125,33 @@ class StudentSkills:
         presence_penalty=0
         )
         # print(f"the response is {response.choices[0].message.content}")
-        matched_records = ast.literal_eval(response.choices[0].message.content)
+        return ast.literal_eval(response.choices[0].message.content)
+
+    @kernel_function(
+        input_description = """ Student Attendance insights generator""",
+        description = """ Generates insights for the attendance of the list of students submitted to it. Here is what the planner must do. First, identify that the ask has an intent to collect attendance of students. Then, the planner must first use UniqueStudentNameExtractor to get the student name list. Then run StudentAttendanceInsightGenerator function for the insights""",
+        name = "StudentAttendanceInsightGenerator",
+    )
+    async def student_attendance_insight_generator(self,name_list:str) -> str:
+        # print(name_list)
+        matched_records, not_found = await resolve_names(self.students.name_index, name_list, "student_id", self.match_names_with_llm)
+        if not matched_records:
+            return not_found_note("student", not_found) or "No matching students found"
         # print(f"The matched records are: {matched_records}")
+        # The memberships come from Graph one student at a time, looked up concurrently; the attendance
+        # of every student is then read in one go
+        semaphore = asyncio.Semaphore(MEMBERSHIP_LOOKUP_CONCURRENCY)
+
+        async def course_ids_of(student_id):
+            async with semaphore:
+                return [course_record["course_id"] for course_record in await self.students.get_courses_of_student(student_id)]
+
+        memberships = await asyncio.gather(*(course_ids_of(student["student_id"]) for student in matched_records))
+        attendance = await self.courses.get_students_attendance(
+            {student["student_id"]: course_ids for student, course_ids in zip(matched_records, memberships)})
         attendance_record = []
         for student in matched_records:
-            course_records = await students_instance.get_courses_of_student(student["student_id"])
-            course_ids = []
-            for course_record in course_records:
-                course_ids.append(course_record["course_id"])
-            student_attendance = await courses_instance.get_student_attendance(student_id = student["student_id"], course_ids = course_ids)
-            student_record = { 'student_name': student['name'], 'student_attendance': student_attendance}
+            student_record = { 'student_name': student['name'], 'student_attendance': attendance[student["student_id"]]}
             attendance_record.append(student_record)
         def generate_md_table(data:str):
             # Define the Markdown table header
@@ -135,14 +173,18 @@ class StudentSkills:
                     md_table += f"{student_name} | {course_name} | {attendance_record_str} | {attendance_percentage}%\n"
 
             return md_table
-        insights = await openai_instance.get_attendance_commentary(attendance_record)
         table = generate_md_table(data = attendance_record)
-        return insights + "\n\n" + table
+        copilot_stream.emit("table", {"function": "StudentSkills.StudentAttendanceInsightGenerator", "markdown": table})
+        course_ids = [course['course_id'] for student in attendance_record for course in student['student_attendance']]
+        insights = await self.openai.get_attendance_commentary(attendance_record, course_ids)
+        return "\n\n".join(part for part in (insights, table, not_found_note("student", not_found)) if part)
 
 class CourseSkills:
     
     
-    def __init__(self):
+    def __init__(self, courses: Courses, openai: OpenAI):
+        self.courses = courses
+        self.openai = openai
         self.openai_client = AsyncAzureOpenAIClientSingleton.get_azure_openai_client()
 
     @kernel_function(
@@ -151,7 +193,7 @@ class CourseSkills:
         name = "GetAllCourses",
     )
     async def get_all_courses(self) -> str:
-        courses = helpers.generate_md_table(await courses_instance.get_all_courses())
+        courses = helpers.generate_md_table(await self.courses.get_all_courses())
         return courses
     @kernel_function(
         input_description = "count courses",
@@ -159,7 +201,7 @@ class CourseSkills:
         name = "GetAllCourseCount",
     )
     async def get_all_course_count(self) -> str:
-        courses = await courses_instance.get_all_courses()
+        courses = await self.courses.get_all_courses()
         count = len(courses)
         return f"There are {count} courses in the Institute"
     
@@ -187,19 +229,9 @@ class CourseSkills:
         names = response.choices[0].message.content
         return names
     
-    @kernel_function(
-        input_description = """ Course Attendance insights generator""",
-        description = """ Generates insights for the attendance of the list of courses submitted to it. Here is what the planner must do. First, identify that the ask has an intent to collect attendance of courses. Then, the planner must first use UniqueCourseNameExtractor to get the course name list. Then run CourseAttendanceInsightGenerator function for the insights""",
-        name = "CourseAttendanceInsightGenerator",
-    )
-    async def course_attendance_insight_generator(self,name_list:str) -> str:
-        # print(name_list)
-        full_records = await courses_instance.get_all_courses()
+    # Matches names the name index could not resolve confidently against the shortlisted records
+    async def match_names_with_llm(self, name_list: list, name_and_id_records: list) -> list:
         max_completion_tokens = 2048
-        name_and_id_records = []
-        for course in full_records:
-            name_and_id_records.append({"name": course['name'], "course_id": course["id"]})
-        # print(name_and_id_records)
         system_prompt = """ START SYSTEM PROMPT You will be given a list of names with variations. Use your intelligence to idenfity the unique records of the given names from the overall list.
             Example (Only for reference to understand the given schema):  START NAMES WITH VARIATIONS ['Basic Reinforced Design','Computr Network'] NAMES WITH VARIATIONS ENDED START OVERALL LIST [{
             "name": "Basic Reinforced Concrete Design",
@@ -228,11 +260,22 @@ class CourseSkills:
         presence_penalty=0
         )
         # print(f"the response is {response.choices[0].message.content}")
-        matched_records = ast.literal_eval(response.choices[0].message.content)
+        return ast.literal_eval(response.choices[0].message.content)
+
+    @kernel_function(
+        input_description = """ Course Attendance insights generator""",
+        description = """ Generates insights for the attendance of the list of courses submitted to it. Here is what the planner must do. First, identify that the ask has an intent to collect attendance of courses. Then, the planner must first use UniqueCourseNameExtractor to get the course name list. Then run CourseAttendanceInsightGenerator function for the insights""",
+        name = "CourseAttendanceInsightGenerator",
+    )
+    async def course_attendance_insight_generator(self,name_list:str) -> str:
+        # print(name_list)
+        matched_records, not_found = await resolve_names(self.courses.name_index, name_list, "course_id", self.match_names_with_llm)
+        if not matched_records:
+            return not_found_note("course", not_found) or "No matching courses found"
         # print(f"The matched records are: {matched_records}")
         attendance_record = []
         for course in matched_records:
-            course_attendance = await courses_instance.get_course_attendance(course_id = course['course_id'])
+            course_attendance = await self.courses.get_course_attendance(course_id = course['course_id'])
             course_record = {'course_name': course['name'], 'course_attendance': course_attendance}
             attendance_record.append(course_record)
         # print(attendance_record)
@@ -248,12 +291,8 @@ class CourseSkills:
                 # Iterate through each student's data in the course
                 for student in course['course_attendance']:
                     student_name = student['student_name']
-                    attendance_records = student['attendance_dates']
-
-                    # Calculate attendance percentage
-                    total_classes = len(attendance_records)
-                    present_classes = sum(1 for record in attendance_records for date, status in record.items() if status == 'P')
-                    attendance_percentage = (present_classes / total_classes) * 100
+                    # Maintained by the attendance writes, no recount needed
+                    attendance_percentage = student['attendance_percentage']
 
                     # Format the attendance record as a string
                     # attendance_record_str = ", ".join([f"{list(record.keys())[0]}: {'Present' if list(record.values())[0] == 'P' else 'Absent'}" for record in attendance_records])
@@ -262,11 +301,12 @@ class CourseSkills:
                     md_table += f"{course_name} | {student_name} | {attendance_percentage:.2f}%\n"
 
             return md_table
-        insights = await openai_instance.get_attendance_commentary(attendance_record)
         table = generate_md_table(attendance_record)
+        copilot_stream.emit("table", {"function": "CourseSkills.CourseAttendanceInsightGenerator", "markdown": table})
+        insights = await self.openai.get_attendance_commentary(attendance_record, [course['course_id'] for course in matched_records])
         print(insights)
         # return generate_md_table(data = attendance_record) + "\n  + \n" + insights
-        return insights + "\n\n" + table
+        return "\n\n".join(part for part in (insights, table, not_found_note("course", not_found)) if part)
 
 # Assuming 'data' contains your attendance record schema as given
 # print(generate_md_table(data))
@@ -1,16 +1,17 @@
+import asyncio
 from configparser import SectionProxy
-import pandas as pd
 from typing import List
 from typing import Dict
 import re
 
 from . import helpers
+from .throttling import AdaptiveConcurrencyLimiter, call_with_backoff
 from .singletons import GraphServiceClientSingleton
+from .extension_catalog import ExtensionCatalog
+from .name_index import NameIndex
 
 from azure.identity.aio import ClientSecretCredential
 from msgraph import GraphServiceClient,GraphRequestAdapter
-from msgraph.generated.applications.get_available_extension_properties import \
-    get_available_extension_properties_post_request_body
 from msgraph.generated.models.password_profile import PasswordProfile
 from msgraph.generated.models.user import User
 from msgraph.generated.users.users_request_builder import UsersRequestBuilder
@@ -24,37 +25,47 @@ class Students:
     def __init__(self, config: SectionProxy):
         self.settings = config
         self.app_client = GraphServiceClientSingleton.get_instance()
+        self.name_index = NameIndex(self.get_all_students, id_key='student_id')
 
-    async def get_all_students(self) -> list:
+    async def get_all_students(self, page_size: int = 999) -> list:
+        student_data = []
+        async for page in self.iter_student_pages(page_size=page_size):
+            student_data.extend(page)
+        return student_data
+
+    # Yields the students one Graph page at a time, so callers can start working on
+    # (or streaming) the first page before the rest of the directory has been read.
+    async def iter_student_pages(self, page_size: int = 100):
         app_id_fetched = self.settings["stu_dir_app"] 
         app_id = re.sub(r'-','',app_id_fetched)
         query_params = UsersRequestBuilder.UsersRequestBuilderGetQueryParameters(
             select=['displayName', 'id', 'faxNumber','mail','jobTitle', 'extension_0a09fe4eefd047798b49f80aaaecb550_student_program'],
             orderby=['displayName'],
             filter = "jobTitle eq 'Student' and jobTitle eq 'student'",
-            count = True
+            count = True,
+            top = page_size
         )
         
         request_config = UsersRequestBuilder.UsersRequestBuilderGetRequestConfiguration(
             query_parameters=query_params
         )
         request_config.headers.add("ConsistencyLevel", "eventual")
-        student_data = []
-        users = await self.app_client.users.get(request_configuration=request_config)
-        for user in users.value:
-            user_data = {}
-            user_data['name'] = user.display_name
-            user_data['registration_number'] = user.fax_number
-            user_data['student_id'] = user.id
-            user_data['mail'] = user.mail
-            job_title = user.job_title
-            user_data["position"] = job_title
-            if user.additional_data:
-                user_data["program"] = user.additional_data[f'extension_{app_id}_student_program']
-            else:
-                user_data['program'] = None
-            student_data.append(user_data)
-        return student_data
+        async for users in helpers.iterate_graph_pages(self.app_client.users, request_config):
+            student_data = []
+            for user in users.value:
+                user_data = {}
+                user_data['name'] = user.display_name
+                user_data['registration_number'] = user.fax_number
+                user_data['student_id'] = user.id
+                user_data['mail'] = user.mail
+                job_title = user.job_title
+                user_data["position"] = job_title
+                if user.additional_data:
+                    user_data["program"] = user.additional_data[f'extension_{app_id}_student_program']
+                else:
+                    user_data['program'] = None
+                student_data.append(user_data)
+            yield student_data
 
     async def update_student_v1(self, student_id, dir_property_name: str, property_value: str):
         student_dir_app = self.settings['stu_dir_app']
@@ -109,6 +120,7 @@ class Students:
 
         result = await self.app_client.users.post(request_body)
         student_id = result.id
+        self.name_index.upsert(student_id, display_name)
 
         password_properties = {
             "password": password,
@@ -117,30 +129,46 @@ class Students:
         }
         return password_properties
 
+    # Provisions many students concurrently and yields one result per input row as soon as
+    # that row finishes, in completion order. Concurrency adapts to Graph throttling: 429/503
+    # responses shrink the limit and pause new creations for the Retry-After period.
+    async def student_creation_stream(self, students_data, max_concurrency: int = 32):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=min(8, max_concurrency), max_limit=max_concurrency)
+
+        async def provision(row, student_properties):
+            try:
+                password_properties = await call_with_backoff(
+                    limiter, lambda: self.student_creation_singular(student_properties))
+            except Exception as error:
+                return {"row": row, "student_name": student_properties.get("student_name"), "error": str(error)}
+            return {"row": row, **password_properties}
+
+        tasks = [asyncio.create_task(provision(row, student)) for row, student in enumerate(students_data)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield await finished
+        finally:
+            # The consumer may stop early (e.g. the client disconnected), do not leave creations running
+            for task in tasks:
+                task.cancel()
+
     async def student_creation_bulk(self, students_data):
+        import pandas as pd
         data_list = []
-        for student in students_data:
-            password, mail, student_id = await self.student_creation_singular(student)
-            new_row = {"mail": mail, "passwords": password, "id": student_id}
+        async for result in self.student_creation_stream(students_data):
+            if "error" in result:
+                new_row = {"row": result["row"], "error": result["error"]}
+            else:
+                new_row = {"row": result["row"], "mail": result["mail"], "passwords": result["password"], "id": result["student_id"]}
             data_list.append(new_row)
+        data_list.sort(key=lambda row: row["row"])
         df_passwords = pd.DataFrame(data_list)
         passwords_json = df_passwords.to_json(orient='records')
         return passwords_json
 
     async def get_student_by_id(self, id_num:str): 
         application_id = self.settings['stu_dir_app']
-        application_id = application_id.strip()
-        extension_request_body = get_available_extension_properties_post_request_body.GetAvailableExtensionPropertiesPostRequestBody()
-        extension_request_body.is_synced_from_on_premises = False
-        result = await self.app_client.directory_objects.get_available_extension_properties.post(
-            extension_request_body)
-        extension_property_names_with_app = []
-        extension_property_names = []
-
-        for value in result.value:
-            if value.name[10:42] == re.sub("-", "", application_id):
-                extension_property_names_with_app.append(value.name)
-                extension_property_names.append(helpers.convert_key(value.name))
+        extension_property_names_with_app = await ExtensionCatalog.get_instance().get_extension_names(application_id)
         query_params = UsersRequestBuilder.UsersRequestBuilderGetQueryParameters(
             select=['displayName', 'id', 'faxNumber'] + [str(value) for value in extension_property_names_with_app],
             # Sort by display name
@@ -161,7 +189,7 @@ class Students:
 
     async def deregister_student(self, student_id):
         await self.app_client.users.by_user_id(student_id).delete()
-        pass
+        self.name_index.remove(student_id)
 
     async def get_courses_of_student(self,student_id):
         courses = []
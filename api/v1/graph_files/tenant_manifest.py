@@ -0,0 +1,73 @@
+import asyncio
+import time
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosHttpResponseError
+from .repository import CosmosRepository
+
+# Keeps the institute manifest of a tenant in memory. The manifest is one document whose id and
+# partition key are both the tenant id, so it is loaded with a point read instead of a cross
+# partition query. After revalidate_after seconds the next lookup sends a conditional read with the
+# cached ETag; an unchanged manifest answers 304 without a body and the cached copy is kept.
+# Sections handed out are shared with every caller and must be treated as read only.
+class TenantManifestCache:
+    _instances = {}
+    repository: CosmosRepository
+
+    def __init__(self, tenant_id: str, revalidate_after: int = 30):
+        self.tenant_id = tenant_id
+        self.revalidate_after = revalidate_after
+        self.repository = CosmosRepository('courses_manipal', 'courses_manipal')
+        self._manifest = None
+        self._validated_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def get_instance(cls, tenant_id: str):
+        if tenant_id not in cls._instances:
+            cls._instances[tenant_id] = TenantManifestCache(tenant_id)
+        return cls._instances[tenant_id]
+
+    async def get_manifest(self) -> dict:
+        if self._manifest is None or time.monotonic() - self._validated_at > self.revalidate_after:
+            return await self._revalidate()
+        return self._manifest
+
+    # get_section('courses', 'grade_type_definitions') returns manifest['courses']['grade_type_definitions']
+    async def get_section(self, *path):
+        section = await self.get_manifest()
+        for key in path:
+            section = section[key]
+        return section
+
+    # Drops the cached copy, the next lookup reads the manifest again
+    def invalidate(self):
+        self._manifest = None
+        self._generation += 1
+
+    async def _revalidate(self):
+        async with self._lock:
+            # Another request may have revalidated the manifest while this one waited on the lock
+            if self._manifest is not None and time.monotonic() - self._validated_at <= self.revalidate_after:
+                return self._manifest
+            generation = self._generation
+            manifest = self._manifest
+            if manifest is None:
+                manifest = await self.repository.read_item(self.tenant_id, partition_key=self.tenant_id)
+            else:
+                try:
+                    changed = await self.repository.read_item(self.tenant_id, partition_key=self.tenant_id,
+                                                              etag=manifest['_etag'],
+                                                              match_condition=MatchConditions.IfModified)
+                except CosmosHttpResponseError as e:
+                    if e.status_code != 304:
+                        raise
+                    changed = None
+                # A 304 comes back without a body
+                if changed:
+                    manifest = changed
+            # A write invalidated the cache during the read, the copy read may predate it
+            if generation == self._generation:
+                self._manifest = manifest
+                self._validated_at = time.monotonic()
+            return manifest
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+# Concurrency limit that adapts to Graph throttling (additive increase, multiplicative decrease).
+# Every success lets one more request run, up to max_limit. A 429/503 halves the limit and pauses
+# new requests for the Retry-After period, so the whole pipeline backs off instead of each task
+# hammering Graph on its own.
+class AdaptiveConcurrencyLimiter:
+    def __init__(self, initial_limit: int = 8, max_limit: int = 32, min_limit: int = 1):
+        self.limit = initial_limit
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    # Waiting on the condition releases it, so in-flight requests can still report back
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout=pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                await self._condition.wait()
+
+    async def release(self, throttled: bool = False, retry_after: float = 0):
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            elif self.limit < self.max_limit:
+                self.limit += 1
+            self._condition.notify_all()
+
+
+# Returns the seconds to wait if error is a Graph 429/503, otherwise None
+def throttle_retry_after(error: Exception, attempt: int):
+    status_code = getattr(error, "response_status_code", None)
+    if status_code not in (429, 503):
+        return None
+    headers = getattr(error, "response_headers", None) or {}
+    retry_after = headers.get("Retry-After") or headers.get("retry-after")
+    if isinstance(retry_after, (list, set, tuple)):
+        retry_after = next(iter(retry_after), None)
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return float(min(2 ** attempt, 60))
+
+
+# Runs operation() under the limiter, retrying on Graph throttling after the Retry-After period
+async def call_with_backoff(limiter: AdaptiveConcurrencyLimiter, operation, max_retries: int = 5):
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        try:
+            result = await operation()
+        except Exception as error:
+            retry_after = throttle_retry_after(error, attempt)
+            await limiter.release(throttled=retry_after is not None, retry_after=retry_after or 0)
+            if retry_after is None or attempt == max_retries:
+                raise
+            continue
+        await limiter.release()
+        return result
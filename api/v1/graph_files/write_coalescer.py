@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+
+# Merges writes aimed at the same course document. Submissions that arrive within `window`
+# seconds are committed together by one call to commit(course_id, submissions), which is
+# expected to read the document, apply every submission and write it back guarded by the
+# document ETag. When another writer got there first (HTTP 412) the commit runs again on a
+# fresh read, so nothing is lost. Commits for one course never overlap; submissions arriving
+# during a commit wait for the next one. drain() commits whatever is still buffered, on shutdown.
+class CourseWriteCoalescer:
+    def __init__(self, commit, window: float = 0.05, max_retries: int = 5):
+        self.commit = commit
+        self.window = window
+        self.max_retries = max_retries
+        self._pending = {}
+        self._committing = set()
+        # The loop only keeps weak references to tasks, a flush nobody holds could be collected
+        self._tasks = set()
+
+    async def submit(self, course_id: str, submission):
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(course_id, [])
+        pending.append((submission, future))
+        if len(pending) == 1 and course_id not in self._committing:
+            asyncio.get_running_loop().call_later(self.window, self._start_flush, course_id)
+        return await future
+
+    def _start_flush(self, course_id: str):
+        if course_id in self._committing or not self._pending.get(course_id):
+            return
+        self._committing.add(course_id)
+        task = asyncio.ensure_future(self._flush(course_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self):
+        while self._tasks or self._pending:
+            for course_id in list(self._pending):
+                self._start_flush(course_id)
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _flush(self, course_id: str):
+        batch = self._pending.pop(course_id)
+        submissions = [submission for submission, _ in batch]
+        try:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self.commit(course_id, submissions)
+                    break
+                except CosmosAccessConditionFailedError:
+                    if attempt == self.max_retries:
+                        raise
+                    logging.info(f"ETag conflict on course {course_id}, re-merging {len(submissions)} submissions")
+                    await asyncio.sleep(0.01 * 2 ** attempt)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(len(submissions))
+        finally:
+            self._committing.discard(course_id)
+            if self._pending.get(course_id):
+                # Submissions queued while committing have already waited at least one window
+                self._start_flush(course_id)
@@ -1,88 +1,42 @@
 from fastapi import APIRouter, Request, Query, status, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from ..graph_files.copilot import UpeaseCopilot
+from ..auth import get_current_user
+from ..services import get_copilot
+from ..graph_files.commentary_cache import CommentaryCache
+from ..graph_files.copilot_stream import format_sse
 
-from configparser import ConfigParser
-from jose import JWTError, jwt
 from typing import List
-from jwcrypto import jwk
-import os
-from public_key_gen import initialize_jwks_cache
-import json
 
 router = APIRouter()
-config = ConfigParser()
-config.read(['config.cfg', 'config.dev.cfg'])
-azure_settings = config['azure']
-semantic_kernel_instance = UpeaseCopilot(azure_settings)
-CLIENT_ID = azure_settings['clientId']
-security = HTTPBearer()
 
 
-# Auth
-def get_token_from_header(request: Request):
-    auth_header = request.headers.get("Authorization")
-    if not auth_header:
-        raise HTTPException(status_code=401, detail="Bearer token missing")
-    
-    token = auth_header.split("Bearer ")[-1]
-    return token
-
-# Get the unverified header and the kid from the token
-
-
-def get_unverified_header(token):
-    unverified_header = jwt.get_unverified_header(token)
-    return unverified_header.get('kid')
-
-
-# Verify the token
-def get_current_user(authorization: HTTPAuthorizationCredentials = Depends(security)):
-    required_scopes = "UpeaseUnified.ReadWrite.All"
-    token = authorization.credentials
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        # Verify the signature
-        public_key_path = 'jwks_cache.json'
-        if not os.path.exists(public_key_path):
-            jwks_data = initialize_jwks_cache(public_key_path)
-        else:
-            with open(public_key_path, 'r') as key_file:
-                jwks_data = json.load(key_file)
-
-        kid = get_unverified_header(token)
+@router.get("/insights")
+async def upease_copilot(query:str, stream: bool = False, semantic_kernel_instance = Depends(get_copilot)):
+    if stream:
+        # Server-sent events, see UpeaseCopilot.upease_copilot_stream for the event types
+        async def events():
+            async for event, data in semantic_kernel_instance.upease_copilot_stream(ask=query):
+                yield format_sse(event, data)
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    result = await semantic_kernel_instance.upease_copilot(ask=query)
+    return result
 
-        # Try to find the key in the cache
-        matching_key_data = next((key for key in jwks_data["keys"] if key["kid"] == kid), None)
-        if matching_key_data:
-            matching_key = jwk.JWK(**matching_key_data)
-            public_key_pem = matching_key.export_to_pem()
-            payload = jwt.decode(token, public_key_pem, algorithms=["RS256"], audience=CLIENT_ID)
-            if payload.get("aud") != CLIENT_ID or payload.get("scp") != required_scopes:
-                raise HTTPException(status_code=401, detail="Invalid audience or scope")
-            return payload
+@router.get("/plan-cache")
+async def get_plan_cache_stats(current_user: dict = Depends(get_current_user), semantic_kernel_instance = Depends(get_copilot)):
+    return semantic_kernel_instance.plan_cache.stats()
 
-        # Refresh the cache and try again
-        jwks_data = initialize_jwks_cache(public_key_path)
-        matching_key_data = next((key for key in jwks_data["keys"] if key["kid"] == kid), None)
-        if matching_key_data:
-            matching_key = jwk.JWK(**matching_key_data)
-            public_key_pem = matching_key.export_to_pem()
-            payload = jwt.decode(token, public_key_pem, algorithms=["RS256"], audience=CLIENT_ID)
-            if payload.get("aud") != CLIENT_ID or payload.get("scp") != required_scopes:
-                raise HTTPException(status_code=401, detail="Invalid audience or scope")
-            return payload
+@router.get("/commentary-cache")
+async def get_commentary_cache_stats(current_user: dict = Depends(get_current_user)):
+    return CommentaryCache.get_instance().stats()
 
-        raise credentials_exception
-    except JWTError as e:
-        raise HTTPException(status_code=401, detail=f"JWT Error: {str(e)}")
+# Prompt tokens of the commentaries sent, next to what they would have been with the raw records
+@router.get("/commentary-prompts")
+async def get_commentary_prompt_stats(current_user: dict = Depends(get_current_user), semantic_kernel_instance = Depends(get_copilot)):
+    return semantic_kernel_instance.openai.prompt_stats()
 
-@router.get("/insights")
-async def upease_copilot(query:str):
-    result = await semantic_kernel_instance.upease_copilot(ask=query)
-    return result
\ No newline at end of file
+# waits counts the asks that found every kernel lent out, a growing number means the pool is too small
+@router.get("/kernel-pool")
+async def get_kernel_pool_stats(current_user: dict = Depends(get_current_user), semantic_kernel_instance = Depends(get_copilot)):
+    return semantic_kernel_instance.kernel_pool.stats()
@@ -0,0 +1,92 @@
+from .graph_files.config import read_azure_config
+from .graph_files.students import Students
+from .graph_files.courses import Courses
+from .graph_files.institute import Institute
+
+# One lazily built set of services per worker, handed to the routes through FastAPI dependencies.
+# Nothing is constructed until a route first asks for it, and the services behind the copilot and
+# the routines are imported on first use, so semantic_kernel and numpy stay out of a worker that
+# never serves them.
+class ServiceContainer:
+    _instance = None
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._services = {}
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = ServiceContainer(read_azure_config())
+        return cls._instance
+
+    def _get(self, name, factory):
+        if name not in self._services:
+            self._services[name] = factory()
+        return self._services[name]
+
+    # Lets the services that were built finish their buffered writes before the clients close
+    async def close(self):
+        if 'courses' in self._services:
+            await self._services['courses'].attendance_writer.drain()
+
+    @property
+    def students(self) -> Students:
+        return self._get('students', lambda: Students(self.settings))
+
+    @property
+    def courses(self) -> Courses:
+        return self._get('courses', lambda: Courses(self.settings))
+
+    @property
+    def institute(self) -> Institute:
+        return self._get('institute', lambda: Institute(self.settings))
+
+    @property
+    def openai(self):
+        def build():
+            from .graph_files.openai import OpenAI
+            return OpenAI(self.settings)
+        return self._get('openai', build)
+
+    @property
+    def grade_routine(self):
+        def build():
+            from .graph_files.grade_routine import GradeRoutine
+            return GradeRoutine(self.settings)
+        return self._get('grade_routine', build)
+
+    @property
+    def announcement_routine(self):
+        def build():
+            from .graph_files.announcement_routine import AnnouncementRoutine
+            return AnnouncementRoutine(self.settings)
+        return self._get('announcement_routine', build)
+
+    @property
+    def copilot(self):
+        def build():
+            from .graph_files.copilot import UpeaseCopilot
+            return UpeaseCopilot(self.settings, students=self.students, courses=self.courses, openai=self.openai)
+        return self._get('copilot', build)
+
+
+# FastAPI dependencies, e.g. students: Students = Depends(get_students)
+
+def get_students() -> Students:
+    return ServiceContainer.get_instance().students
+
+def get_courses() -> Courses:
+    return ServiceContainer.get_instance().courses
+
+def get_institute() -> Institute:
+    return ServiceContainer.get_instance().institute
+
+def get_grade_routine():
+    return ServiceContainer.get_instance().grade_routine
+
+def get_announcement_routine():
+    return ServiceContainer.get_instance().announcement_routine
+
+def get_copilot():
+    return ServiceContainer.get_instance().copilot
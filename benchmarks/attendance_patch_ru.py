@@ -0,0 +1,107 @@
+# Measures the request charge (RU) and latency of attendance writes on synthetic courses, with the
+# legacy full document replace and with the patch write used by Courses.add_attendance_to_course_students.
+# Two writes are measured per class size, since they take different patch paths:
+#   session     one day recorded for the whole class. Beyond 4-5 students this no longer fits the
+#               row patch and sets the status and counter matrices whole (see
+#               AttendanceStore.patch_operations).
+#   correction  one day recorded for a single student, always a row patch.
+#
+# Usage: python -m benchmarks.attendance_patch_ru [--students 4 500] [--days 90] [--rounds 5]
+# Creates and finally deletes documents with ids "benchmark-attendance-<n>" in courses_manipal.
+import argparse
+import asyncio
+import copy
+import json
+import time
+from datetime import date, timedelta
+
+from api.v1.graph_files.attendance import AttendanceStore, migrate_course_document
+from api.v1.graph_files.repository import CosmosRepository, MAX_PATCH_OPERATIONS
+from api.v1.graph_files.singletons import AsyncCosmosServiceClientSingleton
+
+
+def synthetic_course(course_id, students, days):
+    dates = [(date(2023, 8, 1) + timedelta(days=day)).isoformat() for day in range(days)]
+    return {
+        'id': course_id,
+        'courses_manipal': course_id,
+        'name': 'Benchmark course',
+        'properties': {},
+        'students': [{
+            'student_id': f'student-{index}',
+            'registration_number': str(230000000 + index),
+            'student_name': f'Student {index}',
+            'attendance_dates': [{day: 'P' if (index + offset) % 5 else 'A'} for offset, day in enumerate(dates)],
+            'assignments': [],
+        } for index in range(students)],
+    }
+
+
+async def measure(operation):
+    charges = []
+    start = time.perf_counter()
+    await operation(lambda headers, body: charges.append(float(headers['x-ms-request-charge'])))
+    return sum(charges), (time.perf_counter() - start) * 1000
+
+
+def patch_kind(patch_operations):
+    return 'matrix' if any(operation['path'] == '/attendance/status' for operation in patch_operations) else 'row'
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, nargs='+', default=[4, 500])
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    repository = CosmosRepository()
+    results = {}
+    for students in args.students:
+        course_id = f'benchmark-attendance-{students}'
+        legacy = synthetic_course(course_id, students, args.days)
+        compact = copy.deepcopy(legacy)
+        migrate_course_document(compact)
+        print(f"{students} students: document size legacy {len(json.dumps(legacy))} bytes, "
+              f"compact {len(json.dumps(compact))} bytes")
+
+        for write, recorded in (('session', students), ('correction', 1)):
+            for round_number in range(args.rounds):
+                new_date = (date(2024, 1, 1) + timedelta(days=round_number)).isoformat()
+
+                document = copy.deepcopy(legacy)
+                await repository.upsert_item(document)
+                for student in document['students'][:recorded]:
+                    student['attendance_dates'].append({new_date: 'P'})
+                results.setdefault((students, write, 'legacy replace'), []).append(await measure(
+                    lambda hook: repository.replace_item(course_id, document, response_hook=hook)))
+
+                document = copy.deepcopy(compact)
+                await repository.upsert_item(document)
+                store = AttendanceStore.from_course(document)
+                for student in document['students'][:recorded]:
+                    store.record(student['student_id'], new_date, 'P')
+                results.setdefault((students, write, 'compact replace'), []).append(await measure(
+                    lambda hook: repository.replace_item(course_id, document, response_hook=hook)))
+
+                document = copy.deepcopy(compact)
+                await repository.upsert_item(document)
+                store = AttendanceStore.from_course(document)
+                for student in document['students'][:recorded]:
+                    store.record(student['student_id'], new_date, 'P')
+                patch_operations = store.patch_operations(max_operations=MAX_PATCH_OPERATIONS)
+                results.setdefault((students, write, f'{patch_kind(patch_operations)} patch'), []).append(await measure(
+                    lambda hook: repository.patch_item(course_id, patch_operations, response_hook=hook)))
+
+        await repository.container.delete_item(course_id, partition_key=course_id)
+
+    print(f"{'students':>9} {'write':>11} {'method':>16} {'RU':>10} {'latency ms':>12}")
+    for (students, write, method), samples in results.items():
+        request_charge = sum(sample[0] for sample in samples) / len(samples)
+        latency = sum(sample[1] for sample in samples) / len(samples)
+        print(f"{students:>9} {write:>11} {method:>16} {request_charge:>10.2f} {latency:>12.1f}")
+    await AsyncCosmosServiceClientSingleton.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+# Compares the per ask kernel setup the copilot used to do (new Kernel, chat service and skill
+# plugins, then BasicPlanner.create_plan) with borrowing a pre-built kernel from the copilot's pool.
+# The chat service is a stub that answers with a fixed plan after --llm-latency-ms, and the plan
+# calls StudentSkills.GetAllStudentCount on an in-memory student list, so nothing leaves the process
+# and the difference measured is the setup cost.
+#
+# Usage: python -m benchmarks.copilot_kernels [--asks 200] [--concurrency 1 8] [--llm-latency-ms 0]
+# Needs the config files of the API to build the OpenAI client singleton the skills hold.
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+import semantic_kernel as sk
+from semantic_kernel.connectors.ai.ai_service_client_base import AIServiceClientBase
+from semantic_kernel.connectors.ai.chat_completion_client_base import ChatCompletionClientBase
+from semantic_kernel.connectors.ai.text_completion_client_base import TextCompletionClientBase
+from semantic_kernel.models.chat.chat_role import ChatRole
+from semantic_kernel.models.contents import ChatMessageContent, TextContent
+from semantic_kernel.planning.basic_planner import BasicPlanner
+
+from api.v1.graph_files.config import read_azure_config
+from api.v1.graph_files.copilot import UpeaseCopilot
+from api.v1.graph_files.skills import StudentSkills, CourseSkills
+
+PLAN = '{"input": "How many students are there?", "subtasks": [{"function": "StudentSkills.GetAllStudentCount"}]}'
+
+
+class StubChatService(AIServiceClientBase, ChatCompletionClientBase, TextCompletionClientBase):
+    latency: float = 0.0
+
+    async def complete(self, prompt, settings, logger=None):
+        await asyncio.sleep(self.latency)
+        return [TextContent(text=PLAN)]
+
+    async def complete_stream(self, prompt, settings, logger=None):
+        yield [TextContent(text=PLAN)]
+
+    async def complete_chat(self, messages, settings, logger=None):
+        await asyncio.sleep(self.latency)
+        return [ChatMessageContent(role=ChatRole.ASSISTANT, content=PLAN)]
+
+    async def complete_chat_stream(self, messages, settings, logger=None):
+        yield [ChatMessageContent(role=ChatRole.ASSISTANT, content=PLAN)]
+
+
+class StubStudents:
+    async def get_all_students(self):
+        return [{"name": f"Student {index}", "student_id": f"student-{index}"} for index in range(100)]
+
+
+# The request path as it was before the pool, kept here as the baseline
+async def ask_with_fresh_kernel(copilot: UpeaseCopilot, ask: str):
+    kernel = sk.Kernel()
+    kernel.add_chat_service(service=copilot.chat_service, service_id="dv")
+    kernel.import_plugin(plugin_instance=StudentSkills(copilot.students, copilot.courses, copilot.openai),
+                         plugin_name="StudentSkills")
+    kernel.import_plugin(plugin_instance=CourseSkills(copilot.courses, copilot.openai), plugin_name="CourseSkills")
+    planner = BasicPlanner()
+    plan = await planner.create_plan(ask, kernel)
+    return await planner.execute_plan(plan, kernel)
+
+
+async def measure(ask_once, asks, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed_ask():
+        async with semaphore:
+            start = time.perf_counter()
+            await ask_once()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(timed_ask() for _ in range(asks)))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        "mean_ms": statistics.mean(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+        "asks_per_s": asks / elapsed,
+        "peak_kb": peak / 1024,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--asks', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--llm-latency-ms', type=float, default=0)
+    parser.add_argument('--pool-size', type=int, default=4)
+    args = parser.parse_args()
+
+    chat_service = StubChatService(ai_model_id="stub", latency=args.llm_latency_ms / 1000)
+    copilot = UpeaseCopilot(read_azure_config(), students=StubStudents(), courses=None, openai=None,
+                            pool_size=args.pool_size, chat_service=chat_service)
+    await copilot.kernel_pool.warm()
+    ask = "How many students are there?"
+
+    print(f"{'path':>14} {'conc':>5} {'mean ms':>9} {'p95 ms':>9} {'asks/s':>9} {'peak KB':>9}")
+    for concurrency in args.concurrency:
+        for name, ask_once in (('fresh kernel', lambda: ask_with_fresh_kernel(copilot, ask)),
+                               ('pooled kernel', lambda: copilot.upease_copilot(ask))):
+            result = await measure(ask_once, args.asks, concurrency)
+            print(f"{name:>14} {concurrency:>5} {result['mean_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                  f"{result['asks_per_s']:>9.1f} {result['peak_kb']:>9.1f}")
+    print(f"pool: {copilot.kernel_pool.stats()}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
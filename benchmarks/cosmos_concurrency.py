@@ -0,0 +1,57 @@
+# Compares how many concurrent Cosmos reads a single event loop (one uvicorn worker) sustains
+# with the synchronous client called from async code, as the graph_files classes used to do,
+# and with the async CosmosRepository.
+#
+# Usage: python -m benchmarks.cosmos_concurrency --item-id <course_id> [--requests 200] [--concurrency 1 10 50 100]
+import argparse
+import asyncio
+import time
+
+from api.v1.graph_files.singletons import CosmosServiceClientSingleton, AsyncCosmosServiceClientSingleton
+from api.v1.graph_files.repository import CosmosRepository
+
+
+async def run(handler, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await handler()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--item-id', required=True)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 100])
+    args = parser.parse_args()
+
+    sync_container = CosmosServiceClientSingleton.get_instance() \
+        .get_database_client('courses_manipal').get_container_client('courses_manipal')
+    repository = CosmosRepository('courses_manipal', 'courses_manipal')
+
+    async def sync_handler():
+        sync_container.read_item(item=args.item_id, partition_key=args.item_id)
+
+    async def async_handler():
+        await repository.read_item(args.item_id)
+
+    # Warm up connections and caches on both clients
+    await sync_handler()
+    await async_handler()
+
+    print(f"{'concurrency':>12} {'sync req/s':>12} {'async req/s':>12}")
+    for concurrency in args.concurrency:
+        sync_elapsed = await run(sync_handler, args.requests, concurrency)
+        async_elapsed = await run(async_handler, args.requests, concurrency)
+        print(f"{concurrency:>12} {args.requests / sync_elapsed:>12.1f} {args.requests / async_elapsed:>12.1f}")
+
+    await AsyncCosmosServiceClientSingleton.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
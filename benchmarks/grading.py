@@ -0,0 +1,118 @@
+# Compares the per student eval() grading loop the grade routine used to run with the compiled,
+# vectorized GradingSystem, on synthetic cohorts graded with the rules from the rendered manifest.
+#
+# Usage: python -m benchmarks.grading [--sizes 100 1000 10000] [--rounds 5]
+# Runs offline, nothing is read from or written to Cosmos.
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from api.v1.graph_files.grading import GradingSystem
+
+MANIFEST_PATH = 'rendered_manifest_courses.json'
+
+
+# The grading loop as it was before the rules were compiled, kept here as the baseline
+class LegacyGradingSystem:
+    def __init__(self, rules: list):
+        self.rules = rules
+
+    def get_grade_scale(self, grade):
+        for rule in self.rules:
+            if grade == rule['grade']:
+                return rule.get('scale')
+        return None
+
+    def get_grade_by_scale(self, scale):
+        for rule in self.rules:
+            if scale == rule.get('scale'):
+                return rule['grade']
+        return None
+
+    def calculate_absolute_grade(self, score):
+        for rule in self.rules:
+            if rule.get('abs_rule') is not None and eval(rule['abs_rule'], {'total_score': score}):
+                return rule['grade']
+        return None
+
+    def calculate_relative_grade(self, score, mean, std_dev):
+        for rule in self.rules:
+            if rule.get('rel_rule') is not None and \
+                    eval(rule['rel_rule'], {'total_score': score, 'mean': mean, 'std_dev': std_dev}):
+                return rule['grade']
+        return None
+
+    def calculate_grades(self, grade_type: str, scores: list[dict]):
+        score_vals = [score['total_score'] for score in scores]
+        mean = np.mean(score_vals)
+        std_dev = np.std(score_vals)
+        student_grades = []
+        for score in scores:
+            if grade_type == 'absolute':
+                grade = self.calculate_absolute_grade(score['total_score'])
+            else:
+                absolute_scale = self.get_grade_scale(self.calculate_absolute_grade(score['total_score']))
+                relative_scale = self.get_grade_scale(
+                    self.calculate_relative_grade(score['total_score'], mean, std_dev))
+                grade = self.get_grade_by_scale(max(absolute_scale, relative_scale))
+            student_grades.append({
+                'score': score['total_score'],
+                'grade': grade,
+                'student_id': score['student_id'],
+                'student_name': score['student_name'],
+            })
+        return student_grades
+
+
+def manifest_rules():
+    with open(MANIFEST_PATH) as manifest_file:
+        return json.load(manifest_file)['courses']['grade_type_definitions']
+
+
+def synthetic_scores(students):
+    generator = random.Random(students)
+    # Scores strictly inside (0, 100], the legacy loop cannot compare a score no rule matches
+    return [{
+        'student_id': f'student-{index}',
+        'student_name': f'Student {index}',
+        'total_score': min(100.0, max(0.5, generator.gauss(68, 14))),
+    } for index in range(students)]
+
+
+def best_time(operation, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    rules = manifest_rules()
+    legacy = LegacyGradingSystem(rules)
+    print(f"{'students':>9} {'type':>9} {'legacy ms':>10} {'compiled ms':>12} {'speedup':>8}")
+    for students in args.sizes:
+        scores = synthetic_scores(students)
+        for grade_type in ('absolute', 'relative'):
+            if legacy.calculate_grades(grade_type, scores) != \
+                    GradingSystem.for_rules(rules).calculate_grades(grade_type, scores):
+                raise SystemExit(f"Grades differ for {students} students ({grade_type})")
+            legacy_ms = best_time(lambda: legacy.calculate_grades(grade_type, scores), args.rounds)
+            # Includes the compiled system lookup, as every request pays it
+            compiled_ms = best_time(
+                lambda: GradingSystem.for_rules(rules).calculate_grades(grade_type, scores), args.rounds)
+            print(f"{students:>9} {grade_type:>9} {legacy_ms:>10.2f} {compiled_ms:>12.2f} "
+                  f"{legacy_ms / compiled_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
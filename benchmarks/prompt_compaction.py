@@ -0,0 +1,52 @@
+# Prompt tokens of the attendance commentary with the raw records embedded, as it used to be sent,
+# and with the compacted summary, for synthetic course asks of growing size. Offline, nothing is
+# sent to the model. Counts are exact when tiktoken is installed and estimated otherwise.
+#
+# Usage: python -m benchmarks.prompt_compaction [--students 30 60 120] [--days 30 90]
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from api.v1.graph_files.prompt_compaction import compact_attendance, count_tokens, EXACT_TOKEN_COUNTS
+from api.v1.graph_files.openai import COMMENTARY_PROMPT, COMMENTARY_DATA_TOKEN_BUDGET
+
+
+def synthetic_course_attendance(students, days):
+    dates = [(date(2023, 8, 1) + timedelta(days=day)).isoformat() for day in range(days)]
+    course_attendance = []
+    for index in range(students):
+        presence = random.uniform(0.55, 0.98)
+        course_attendance.append({
+            "student_name": f"Student {index}",
+            "student_id": f"student-{index}",
+            "attendance_dates": [{day: 'P' if random.random() < presence else 'A'} for day in dates],
+        })
+    return [{"course_name": "Computer Networks", "course_attendance": course_attendance}]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--students', type=int, nargs='+', default=[30, 60, 120])
+    parser.add_argument('--days', type=int, nargs='+', default=[30, 90])
+    parser.add_argument('--budget', type=int, default=COMMENTARY_DATA_TOKEN_BUDGET)
+    args = parser.parse_args()
+    random.seed(7)
+
+    print(f"token counts {'exact (tiktoken)' if EXACT_TOKEN_COUNTS else 'estimated'}, budget {args.budget}")
+    print(f"{'students':>9} {'days':>5} {'raw':>9} {'compacted':>10} {'ratio':>7} {'compact ms':>11}")
+    instructions = count_tokens(COMMENTARY_PROMPT)
+    for students in args.students:
+        for days in args.days:
+            attendance = synthetic_course_attendance(students, days)
+            start = time.perf_counter()
+            compacted = compact_attendance(attendance, args.budget)
+            elapsed = (time.perf_counter() - start) * 1000
+            raw_tokens = instructions + count_tokens(str(attendance))
+            compacted_tokens = instructions + count_tokens(compacted)
+            print(f"{students:>9} {days:>5} {raw_tokens:>9} {compacted_tokens:>10} "
+                  f"{raw_tokens / compacted_tokens:>6.1f}x {elapsed:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
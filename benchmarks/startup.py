@@ -0,0 +1,70 @@
+# Measures what a uvicorn worker pays before serving its first request: the time to import main,
+# the cold start (startup events plus a first request) and the resident memory after each step.
+# Every run is a fresh interpreter, like a newly spawned worker. Also lists which of the heavy
+# modules (semantic_kernel, pandas, numpy) the worker loaded without being asked to.
+#
+# Usage: python -m benchmarks.startup [--runs 5] [--path /openapi.json]
+# Needs the config files of the API; the first request does not call Graph or Cosmos.
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('semantic_kernel', 'pandas', 'numpy')
+
+WORKER = r'''
+import json, sys, time
+
+def rss_mb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+import_rss = rss_mb()
+
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    client.get(sys.argv[1])
+    started = time.perf_counter()
+    start_rss = rss_mb()
+
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "cold_start_ms": (started - start) * 1000,
+    "import_rss_mb": import_rss,
+    "start_rss_mb": start_rss,
+    "heavy_modules": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+'''
+
+
+def run_worker(path):
+    output = subprocess.run([sys.executable, '-c', WORKER, path, *HEAVY_MODULES],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/openapi.json')
+    args = parser.parse_args()
+
+    samples = [run_worker(args.path) for _ in range(args.runs)]
+    for metric, unit in (('import_ms', 'ms'), ('cold_start_ms', 'ms'), ('import_rss_mb', 'MB'), ('start_rss_mb', 'MB')):
+        values = [sample[metric] for sample in samples]
+        print(f"{metric:>14}: median {statistics.median(values):8.1f} {unit}  "
+              f"(min {min(values):.1f}, max {max(values):.1f})")
+    loaded = sorted({name for sample in samples for name in sample['heavy_modules']})
+    print(f"heavy modules loaded at startup: {', '.join(loaded) if loaded else 'none'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,9 @@
 import json
-import configparser
-import pandas as pd
 from msgraph.generated.models.o_data_errors.o_data_error import ODataError
 from typing import List, Optional
 from jose import JWTError, jwt
 import logging 
+import asyncio
 
 from fastapi import FastAPI, Body, Depends, HTTPException, Request, Query, Security
 from fastapi.responses import JSONResponse
@@ -16,6 +15,12 @@ from api.v1.routes.institute import router as InstituteRouter
 from api.v1.routes.students import router as StudentsRouter
 from api.v1.routes.routines import router as RoutinesRouter
 from api.v1.routes.copilot import router as CopilotRouter
+from api.v1.auth import refresh_jwks_periodically, get_current_user, token_cache
+from api.v1.graph_files.singletons import AsyncCosmosServiceClientSingleton
+from api.v1.graph_files.graph_batch import GraphBatchClient
+from api.v1.graph_files.attendance_projection import AttendanceProjection
+from api.v1.graph_files.config import read_azure_config
+from api.v1.services import ServiceContainer, get_copilot
 
 app = FastAPI()
 security = HTTPBearer()
@@ -41,14 +46,6 @@ logging.basicConfig(level=logging.WARNING)
 
 
 
-# Setup
-config = configparser.ConfigParser()
-config.read(['config.cfg', 'config.dev.cfg'])
-azure_settings = config['azure']
-CLIENT_ID = azure_settings['clientId']
-CLIENT_SECRET = azure_settings['clientSecret']
-
-
 # Routers
 app.include_router(StudentsRouter, tags=["Students"], prefix="/api/v1/students")
 app.include_router(CoursesRouter, tags=["Courses"], prefix="/api/v1/courses")
@@ -58,6 +55,48 @@ app.include_router(CopilotRouter, tags=["Copilot"], prefix="/api/v1/copilot")
     
 # To secure an endpoint, add the parameter current_user:dict = Depends(get_current_user) to the requesting function.
 
+@app.on_event("startup")
+async def start_jwks_refresh():
+    app.state.jwks_refresh_task = asyncio.create_task(refresh_jwks_periodically())
+
+# A fresh deployment serves and updates the attendance projection before anyone runs
+# rebuild-attendance-projection. Without Cosmos the API still starts, the reads fall back to the
+# course documents.
+@app.on_event("startup")
+async def create_attendance_projection():
+    try:
+        await AttendanceProjection.ensure_container()
+    except Exception as e:
+        logging.error(f"Could not create the attendance projection container: {e}")
+
+# Builds the copilot's kernel pool before the first ask when copilot_warm_start = true is set in the
+# config. Off by default, so workers that never serve the copilot do not load semantic_kernel.
+@app.on_event("startup")
+async def warm_copilot_kernels():
+    if read_azure_config().getboolean('copilot_warm_start', fallback=False):
+        await get_copilot().kernel_pool.warm()
+
+@app.on_event("shutdown")
+async def stop_jwks_refresh():
+    app.state.jwks_refresh_task.cancel()
+
+# Runs before the Cosmos client is closed, the attendance still buffered for a commit is written
+@app.on_event("shutdown")
+async def flush_buffered_writes():
+    await ServiceContainer.get_instance().close()
+
+@app.on_event("shutdown")
+async def close_cosmos_client():
+    await AsyncCosmosServiceClientSingleton.close()
+
+@app.on_event("shutdown")
+async def close_graph_batch_client():
+    await GraphBatchClient.close()
+
+@app.get("/api/v1/auth/token-cache", tags=["Auth"])
+async def get_token_cache_stats(current_user: dict = Depends(get_current_user)):
+    return token_cache.stats()
+
 @app.exception_handler(ODataError)
 async def odata_error_handler(request: Request, exc: ODataError):
     logging.error(f"OData Error: {exc.error.code} - {exc.error.message}")
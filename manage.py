@@ -0,0 +1,124 @@
+# Maintenance commands for the Cosmos data behind the API.
+#
+# Usage: python manage.py migrate-attendance [--dry-run]
+#        python manage.py rebuild-attendance-projection
+#        python manage.py check-attendance-counters [--fix]
+#        python manage.py grade-courses --grade-type relative [--workers 8]
+#
+# The commands import what they use themselves: grade-courses runs a spawn process pool, and every
+# worker re-imports this module as __mp_main__, so module level imports would load the Cosmos and
+# Graph clients in each of them.
+import argparse
+import asyncio
+import json
+
+# Rewrites course documents still using per student attendance_dates lists in the compact format
+async def migrate_attendance(args):
+    from azure.core import MatchConditions
+    from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+    from api.v1.graph_files.attendance import migrate_course_document
+    from api.v1.graph_files.repository import CosmosRepository, COURSE_DOCUMENTS_QUERY
+
+    repository = CosmosRepository()
+    migrated = skipped = 0
+    size_before = size_after = 0
+    async for course in repository.iter_items(COURSE_DOCUMENTS_QUERY):
+        legacy_size = len(json.dumps(course['students']))
+        if not migrate_course_document(course):
+            continue
+        size_before += legacy_size
+        size_after += len(json.dumps(course['students'])) + len(json.dumps(course['attendance']))
+        if not args.dry_run:
+            try:
+                await repository.replace_item(course['id'], course, etag=course['_etag'],
+                                              match_condition=MatchConditions.IfNotModified)
+            except CosmosAccessConditionFailedError:
+                # Written by the API meanwhile, which already migrated it in the new format
+                skipped += 1
+                continue
+        migrated += 1
+    print(f"Migrated {migrated} course documents, {skipped} changed concurrently and were skipped")
+    if size_after:
+        print(f"Students and attendance size: {size_before} -> {size_after} bytes ({size_before / size_after:.1f}x smaller)")
+
+
+# Backfills the student partitioned attendance projection from every course document
+async def rebuild_attendance_projection(args):
+    from api.v1.graph_files.attendance_projection import AttendanceProjection
+    from api.v1.graph_files.repository import CosmosRepository, COURSE_DOCUMENTS_QUERY
+
+    repository = CosmosRepository()
+    courses = await AttendanceProjection().rebuild(repository.iter_items(COURSE_DOCUMENTS_QUERY))
+    print(f"Rebuilt the attendance projection from {courses} course documents")
+
+
+# Recomputes the present/absent/total counters from the raw status columns and reports drift.
+# With --fix the drifted counters are written back; rebuild the projection afterwards.
+async def check_attendance_counters(args):
+    from azure.core import MatchConditions
+    from azure.cosmos.exceptions import CosmosAccessConditionFailedError
+    from api.v1.graph_files.attendance import AttendanceStore
+    from api.v1.graph_files.repository import CosmosRepository, COURSE_DOCUMENTS_QUERY
+
+    repository = CosmosRepository()
+    checked = drifted = 0
+    async for course in repository.iter_items(COURSE_DOCUMENTS_QUERY):
+        checked += 1
+        store = AttendanceStore.from_course(course)
+        drift = store.check_counters()
+        if not drift:
+            continue
+        drifted += 1
+        for student_id, (stored, actual) in drift.items():
+            print(f"course {course['id']} student {student_id}: stored {stored}, recomputed {actual}")
+        if args.fix:
+            store.fix_counters()
+            try:
+                await repository.patch_item(course['id'], [{"op": "set", "path": "/attendance/counts", "value": store.counts}],
+                                            etag=course['_etag'], match_condition=MatchConditions.IfNotModified)
+            except CosmosAccessConditionFailedError:
+                print(f"course {course['id']} changed while checking, run the check again")
+    print(f"Checked {checked} course documents, {drifted} with drifted counters")
+
+
+# Computes the grades of every course on a process pool and stores them in the course_grades container
+async def grade_courses(args):
+    from api.v1.graph_files.config import read_azure_config
+    from api.v1.graph_files.grade_routine import GradeRoutine
+
+    def report_progress(course_id, completed, total, error):
+        status = f"failed: {error}" if error else "graded"
+        print(f"[{completed}/{total}] course {course_id} {status}")
+
+    report = await GradeRoutine(read_azure_config()).evaluate_grades_for_institute(
+        args.grade_type, max_workers=args.workers, on_progress=report_progress)
+    print(f"Graded {report['graded']} of {report['courses']} courses, {len(report['failed'])} failed")
+    for course_id, error in report['failed'].items():
+        print(f"  {course_id}: {error}")
+
+
+COMMANDS = {
+    'migrate-attendance': migrate_attendance,
+    'rebuild-attendance-projection': rebuild_attendance_projection,
+    'check-attendance-counters': check_attendance_counters,
+    'grade-courses': grade_courses,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--fix', action='store_true')
+    parser.add_argument('--grade-type', choices=['absolute', 'relative'], default='relative')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    from api.v1.graph_files.singletons import AsyncCosmosServiceClientSingleton
+    try:
+        await COMMANDS[args.command](args)
+    finally:
+        await AsyncCosmosServiceClientSingleton.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
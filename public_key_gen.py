@@ -1,17 +1,99 @@
-import requests
-from jwcrypto import jwk
+import asyncio
+import httpx
+from jose import jwk as jose_jwk
 import json
+import os
+import time
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPAuthorizationCredentials
 
-def initialize_jwks_cache(filename):
-    jwks_uri = r'https://login.microsoftonline.com/common/discovery/v2.0/keys'
-    response = requests.get(jwks_uri)
-    if response.status_code == 200:
-        jwks_data = response.json()
-        with open(filename, 'w') as file:
+JWKS_URI = r'https://login.microsoftonline.com/common/discovery/v2.0/keys'
+JWKS_CACHE_PATH = 'jwks_cache.json'
+
+# Holds the signing keys of the JWKS document already parsed into verification keys, indexed by kid.
+# Token verification only does a dictionary lookup; the file and the network are touched on load and refresh.
+# Refreshes are async and single-flight: concurrent callers share one in-flight fetch, fetches are spaced
+# by min_refresh_interval, and kids that were still missing after a fetch are remembered for missing_kid_ttl.
+class JWKSKeyRegistry:
+    _instance = None
+
+    def __init__(self, cache_path: str = JWKS_CACHE_PATH, jwks_uri: str = JWKS_URI, refresh_interval: int = 3600,
+                 min_refresh_interval: int = 60, missing_kid_ttl: int = 300, transport=None):
+        self.cache_path = cache_path
+        self.jwks_uri = jwks_uri
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.missing_kid_ttl = missing_kid_ttl
+        # httpx transport of the fetches, the default network one unless replaced (tests use a MockTransport)
+        self.transport = transport
+        self.keys = {}
+        self.last_refresh = None
+        self.missing_kids = {}
+        self._refresh_task = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls._instance is None:
+            cls._instance = JWKSKeyRegistry()
+            cls._instance.load()
+        return cls._instance
+
+    def load(self):
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, 'r') as key_file:
+                jwks_data = json.load(key_file)
+            self._install(jwks_data)
+
+    def get_key(self, kid):
+        return self.keys.get(kid)
+
+    async def get_key_or_refresh(self, kid):
+        key = self.keys.get(kid)
+        if key is not None:
+            return key
+        missing_until = self.missing_kids.get(kid)
+        if missing_until is not None and missing_until > time.monotonic():
+            return None
+        fetched = await self.refresh()
+        key = self.keys.get(kid)
+        # Only a fetch that ran proves the kid is not published, a rate limited refresh proves nothing
+        if key is None and fetched:
+            self.missing_kids[kid] = time.monotonic() + self.missing_kid_ttl
+        return key
+
+    # Returns whether a fetch completed, False when it was skipped for min_refresh_interval
+    async def refresh(self, force: bool = False) -> bool:
+        if self._refresh_task is None:
+            if not force and self.last_refresh is not None and \
+                    time.monotonic() - self.last_refresh < self.min_refresh_interval:
+                return False
+            self._refresh_task = asyncio.ensure_future(self._fetch_and_install())
+        # Shield the shared fetch so a cancelled caller does not cancel it for everyone else
+        await asyncio.shield(self._refresh_task)
+        return True
+
+    async def _fetch_and_install(self):
+        try:
+            async with httpx.AsyncClient(timeout=10, transport=self.transport) as client:
+                response = await client.get(self.jwks_uri)
+            if response.status_code != 200:
+                raise HTTPException(status_code=500, detail=f"Failed to fetch JWKS: HTTP {response.status_code}")
+            jwks_data = response.json()
+            self._install(jwks_data)
+            self.missing_kids = {}
+            await asyncio.to_thread(self._write_cache_file, jwks_data)
+        finally:
+            self.last_refresh = time.monotonic()
+            self._refresh_task = None
+
+    def _write_cache_file(self, jwks_data):
+        with open(self.cache_path, 'w') as file:
             json.dump(jwks_data, file, indent=4)
-        return jwks_data
-    else:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch JWKS: HTTP {response.status_code}")
 
+    def _install(self, jwks_data):
+        keys = {}
+        for key_data in jwks_data.get("keys", []):
+            if "kid" not in key_data:
+                continue
+            keys[key_data["kid"]] = jose_jwk.construct(key_data, algorithm="RS256")
+        self.keys = keys
@@ -0,0 +1,31 @@
+from api.v1.graph_files.attendance import AttendanceStore
+
+
+def course(sequence=None):
+    attendance = {"version": 3, "dates": ["2023-10-02"], "index": {"s0": 0, "s1": 1},
+                  "status": ["P", "A"], "counts": [[1, 0, 1], [0, 1, 1]]}
+    if sequence is not None:
+        attendance["sequence"] = sequence
+    return {"id": "course", "students": [{"student_id": "s0"}, {"student_id": "s1"}], "attendance": attendance}
+
+
+def test_sequence_goes_out_with_the_row_patch():
+    store = AttendanceStore.from_course(course(sequence=4))
+    store.record("s1", "2023-10-03", "P")
+    assert store.changed
+    assert store.advance_sequence() == 5
+    assert {"op": "set", "path": "/attendance/sequence", "value": 5} in store.patch_operations(max_operations=10)
+
+
+def test_documents_without_a_sequence_start_at_zero():
+    store = AttendanceStore.from_course(course())
+    assert store.sequence == 0
+    store.record("s0", "2023-10-03", "A")
+    assert store.advance_sequence() == 1
+
+
+def test_recording_an_existing_status_is_not_a_change():
+    store = AttendanceStore.from_course(course(sequence=4))
+    assert not store.record("s0", "2023-10-02", "A")
+    assert not store.changed
+    assert store.patch_operations(max_operations=10) == []
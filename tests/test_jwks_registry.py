@@ -0,0 +1,96 @@
+import asyncio
+import copy
+import json
+from pathlib import Path
+
+import httpx
+
+from public_key_gen import JWKSKeyRegistry
+
+SIGNING_KEY = json.loads((Path(__file__).resolve().parent.parent / "jwks_cache.json").read_text())["keys"][0]
+
+
+def jwks(*kids):
+    keys = []
+    for kid in kids:
+        key = copy.deepcopy(SIGNING_KEY)
+        key["kid"] = kid
+        keys.append(key)
+    return {"keys": keys}
+
+
+# A local JWKS endpoint serving whatever kids are in published, counting the fetches
+class FakeJWKSEndpoint:
+    def __init__(self, *kids, latency: float = 0.0):
+        self.published = list(kids)
+        self.latency = latency
+        self.fetches = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.fetches += 1
+        await asyncio.sleep(self.latency)
+        return httpx.Response(200, json=jwks(*self.published))
+
+    def registry(self, tmp_path, **kwargs) -> JWKSKeyRegistry:
+        return JWKSKeyRegistry(cache_path=str(tmp_path / "jwks_cache.json"), jwks_uri="https://jwks.test/keys",
+                               transport=httpx.MockTransport(self.handle), **kwargs)
+
+
+def test_unknown_kid_triggers_one_shared_fetch(tmp_path):
+    endpoint = FakeJWKSEndpoint("rotated", latency=0.05)
+    registry = endpoint.registry(tmp_path)
+
+    async def lookups():
+        return await asyncio.gather(*(registry.get_key_or_refresh("rotated") for _ in range(20)))
+
+    keys = asyncio.run(lookups())
+    assert endpoint.fetches == 1
+    assert all(key is not None for key in keys)
+    assert json.loads((tmp_path / "jwks_cache.json").read_text()) == jwks("rotated")
+
+
+def test_rate_limited_refresh_does_not_mark_kid_missing(tmp_path):
+    endpoint = FakeJWKSEndpoint("old")
+    registry = endpoint.registry(tmp_path, min_refresh_interval=60)
+
+    async def scenario():
+        assert await registry.get_key_or_refresh("old") is not None
+        # Rotated right after the last fetch: the refresh is skipped for min_refresh_interval
+        endpoint.published.append("new")
+        assert await registry.get_key_or_refresh("new") is None
+        assert endpoint.fetches == 1
+        assert "new" not in registry.missing_kids
+        # Once the interval is over the next lookup fetches and finds it
+        registry.last_refresh -= 61
+        return await registry.get_key_or_refresh("new")
+
+    assert asyncio.run(scenario()) is not None
+    assert endpoint.fetches == 2
+
+
+def test_negative_cached_kid_is_not_refetched(tmp_path):
+    endpoint = FakeJWKSEndpoint("known")
+    registry = endpoint.registry(tmp_path, min_refresh_interval=0, missing_kid_ttl=300)
+
+    async def scenario():
+        assert await registry.get_key_or_refresh("forged") is None
+        assert "forged" in registry.missing_kids
+        for _ in range(5):
+            assert await registry.get_key_or_refresh("forged") is None
+
+    asyncio.run(scenario())
+    assert endpoint.fetches == 1
+
+
+def test_negative_cache_expires(tmp_path):
+    endpoint = FakeJWKSEndpoint("known")
+    registry = endpoint.registry(tmp_path, min_refresh_interval=0, missing_kid_ttl=300)
+
+    async def scenario():
+        assert await registry.get_key_or_refresh("later") is None
+        endpoint.published.append("later")
+        registry.missing_kids["later"] -= 301
+        return await registry.get_key_or_refresh("later")
+
+    assert asyncio.run(scenario()) is not None
+    assert endpoint.fetches == 2
@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+from api.v1.graph_files.plan_cache import PlanCache, normalize_ask
+
+ROSTERS = {"Karthik Prabhu": "student", "Lance Barreto": "student", "Computer Networks": "course",
+           "Aerospace Dynamics": "course"}
+
+
+async def classify(name):
+    return ROSTERS.get(name)
+
+
+def student_plan(name):
+    return json.dumps({"input": f"Show attendance of {name}", "subtasks": [
+        {"function": "StudentSkills.UniqueStudentNameExtractor", "args": {"query": f"attendance of {name}"}},
+        {"function": "StudentSkills.StudentAttendanceInsightGenerator"}]})
+
+
+def test_normalize_ask_numbers_entities_in_order():
+    assert normalize_ask("Attendance of Karthik Prabhu and Lance") == \
+        ("attendance of {{entity_0}} and {{entity_1}}", ["Karthik Prabhu", "Lance"])
+
+
+def test_plan_is_rebound_for_an_entity_of_the_same_kind():
+    async def scenario():
+        cache = PlanCache(classify=classify)
+        assert await cache.put("Show attendance of Karthik Prabhu", student_plan("Karthik Prabhu"))
+        return await cache.get("Show attendance of Lance Barreto")
+
+    assert json.loads(asyncio.run(scenario())) == json.loads(student_plan("Lance Barreto"))
+
+
+def test_plan_is_not_reused_for_an_entity_of_another_kind():
+    async def scenario():
+        cache = PlanCache(classify=classify)
+        assert await cache.put("Show attendance of Karthik Prabhu", student_plan("Karthik Prabhu"))
+        return await cache.get("Show attendance of Computer Networks")
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_asks_with_an_unknown_entity_are_not_cached():
+    async def scenario():
+        cache = PlanCache(classify=classify)
+        cached = await cache.put("Show attendance of Someone Else", student_plan("Someone Else"))
+        return cached, cache.stats()
+
+    cached, stats = asyncio.run(scenario())
+    assert not cached
+    assert stats["uncacheable"] == 1 and stats["size"] == 0
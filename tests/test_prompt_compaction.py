@@ -0,0 +1,39 @@
+from api.v1.graph_files.prompt_compaction import compact_attendance, summarize_record
+
+
+def course(name, students):
+    return {"course_name": name, "course_attendance": [
+        {"student_name": student_name, "student_id": student_name,
+         "attendance_dates": [{date: status} for date, status in record.items()]}
+        for student_name, record in students.items()]}
+
+
+def test_summarize_record_streaks_and_clusters():
+    summary = summarize_record({"2023-10-02": "P", "2023-10-03": "A", "2023-10-04": "A", "2023-10-05": "P",
+                                "2023-10-06": "A"})
+    assert summary["percentage"] == 40.0
+    assert summary["longest_absence_run"] == 2
+    assert summary["current_run"] == "A1"
+    assert summary["absence_clusters"] == [("2023-10-03", "2023-10-04", 2)]
+
+
+def test_students_without_sessions_do_not_count_as_absent():
+    text = compact_attendance([course("Computer Networks", {
+        "Karthik Prabhu": {"2023-10-02": "P", "2023-10-03": "P"},
+        "Lance Barreto": {},
+    })], token_budget=1500)
+    assert "Computer Networks: 2 students, mean attendance 100.0%, 0 under 75%, 1 without sessions" in text
+    assert "Lance Barreto | Computer Networks | no sessions" in text
+
+
+def test_course_without_students_keeps_its_line():
+    text = compact_attendance([course("Aerospace Dynamics", {})], token_budget=1500)
+    assert "Aerospace Dynamics: no students enrolled" in text
+
+
+def test_over_budget_keeps_the_worst_attended_rows():
+    students = {f"Student {index}": {f"2023-10-{day:02d}": "P" if day % 10 > index % 10 else "A" for day in range(1, 31)}
+                for index in range(200)}
+    text = compact_attendance([course("Computer Networks", students)], token_budget=600)
+    assert "more rows, attendance between" in text
+    assert "Student 9 |" in text